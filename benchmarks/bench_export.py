@@ -0,0 +1,96 @@
+"""图片管理工具（图片管理工具.py）导出的基准测试。
+
+对同一批图片依次执行 JPG 导出（ExportJpgThread）和各档位的 PDF 导出
+（ExportPdfThread，archive / screen / preview），记录耗时与输出大小。
+线程的 run() 直接在当前线程里同步调用，不需要事件循环。不指定 --dir 时
+生成一批合成图片（JPEG 与带透明通道的 PNG 混合）。结果以 JSON 输出：
+
+    python benchmarks/bench_export.py --count 60 --out bench_export.json
+    python benchmarks/bench_export.py --dir D:/照片/某文件夹 --profiles screen preview
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+
+from bench_thumbnails import EXTS, load_image_tool, generate_images, git_revision
+
+
+def folder_bytes(folder):
+    return sum(e.stat().st_size for e in os.scandir(folder) if e.is_file())
+
+
+def bench_jpg(tool, paths, out_dir):
+    os.makedirs(out_dir, exist_ok=True)
+    tasks = [(p, os.path.join(out_dir, f"{10 + i*10:03d}.jpg")) for i, p in enumerate(paths)]
+    worker = tool.ExportJpgThread(tasks)
+    result = {}
+    worker.done_signal.connect(lambda count, copied, cancelled, failures: result.update(
+        count=count, copied=copied, failed=len(failures)))
+    t0 = time.perf_counter()
+    worker.run()
+    result["seconds"] = round(time.perf_counter() - t0, 3)
+    result["output_mb"] = round(folder_bytes(out_dir) / (1024 * 1024), 2)
+    return result
+
+
+def bench_pdf(tool, paths, out_path, profile):
+    worker = tool.ExportPdfThread(paths, out_path, profile)
+    result = {"profile": profile}
+    worker.done_signal.connect(lambda pages, cancelled, error, seconds, failures: result.update(
+        pages=pages, failed=len(failures), error=error or None))
+    t0 = time.perf_counter()
+    worker.run()
+    result["seconds"] = round(time.perf_counter() - t0, 3)
+    result["output_mb"] = round(os.path.getsize(out_path) / (1024 * 1024), 2) if os.path.exists(out_path) else None
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dir", help="用已有的图片文件夹测试（默认生成合成图片）")
+    parser.add_argument("--count", type=int, default=40, help="合成图片数量")
+    parser.add_argument("--size", default="2048x3072", help="合成图片尺寸，宽x高")
+    parser.add_argument("--profiles", nargs="+", default=None, help="要测的 PDF 档位（默认全部）")
+    parser.add_argument("--out", help="结果 JSON 的保存路径（默认只打印）")
+    args = parser.parse_args()
+
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    tool = load_image_tool()
+    profiles = args.profiles or list(tool.PDF_PROFILES)
+    report = {
+        "benchmark": "export",
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        folder = args.dir
+        if not folder:
+            folder = os.path.join(workdir, "src")
+            os.makedirs(folder)
+            generate_images(folder, args.count, tuple(int(x) for x in args.size.lower().split("x")))
+            report["synthetic"] = {"count": args.count, "size": args.size}
+        paths = sorted(os.path.join(folder, f) for f in os.listdir(folder) if f.lower().endswith(EXTS))
+        report["images"] = len(paths)
+        report["source_mb"] = round(sum(os.path.getsize(p) for p in paths) / (1024 * 1024), 2)
+        report["jpg"] = bench_jpg(tool, paths, os.path.join(workdir, "jpg"))
+        print("jpg 完成", file=sys.stderr)
+        report["pdf"] = []
+        for profile in profiles:
+            report["pdf"].append(bench_pdf(tool, paths, os.path.join(workdir, f"{profile}.pdf"), profile))
+            print(f"pdf {profile} 完成", file=sys.stderr)
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""动作计划生成器（动作选取.py）的基准测试。
+
+按 DEFAULT_COL_MAPPING 的列布局生成合成动作库（每个映射列一列动作 + 右侧一列翻译，
+首行是子分类表头），然后无界面地测量：
+
+    ingest   读取并解析工作簿（ActionLibrary.load）
+    dedup_index  建立跨分类查重索引（ActionDedupIndex.build）
+    draw     为所有分类抽取动作（draw_category，对应 process_category_data）
+    plan     展开成计划行（build_plan，对应 generate_plan）
+    edit     批量编辑：全选后加 tag、删 tag、复制、上下移动
+    export   写出 ComfyUI 批处理表格（write_plan_xlsx，对应 export_excel）
+
+结果以 JSON 输出，方便在不同版本之间比对：
+
+    python benchmarks/bench_planner.py --sizes 1000 10000 100000 --out bench_planner.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import string
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import importlib.util
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_planner():
+    spec = importlib.util.spec_from_file_location("planner", os.path.join(ROOT, "动作选取.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["planner"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_tag(rng, n_tags):
+    words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))) for _ in range(n_tags)]
+    return ", ".join(words)
+
+
+def generate_workbook(planner, path, rows, seed=0):
+    """生成 rows 行动作的合成工作簿；动作在各映射列之间平均分配"""
+    from openpyxl import Workbook
+
+    rng = random.Random(seed)
+    col_indices = []
+    for cat in planner.DEFAULT_COL_MAPPING:
+        setting = planner.DEFAULT_COL_MAPPING[cat]
+        cols = setting["cols"] if isinstance(setting, dict) else setting
+        col_indices.extend(cols)
+    width = max(col_indices) + 2
+    per_col = max(1, rows // len(col_indices))
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("动作库")
+    header = [None] * width
+    for col in col_indices:
+        header[col] = f"子分类{col}"
+    ws.append(header)
+    for r in range(per_col):
+        line = [None] * width
+        for col in col_indices:
+            line[col] = make_tag(rng, rng.randint(3, 8))
+            line[col + 1] = f"动作{col}-{r}"
+        ws.append(line)
+    wb.save(path)
+    return per_col * len(col_indices)
+
+
+def measure(func, repeat):
+    times = []
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - t0)
+    return {"min_s": round(min(times), 6), "median_s": round(statistics.median(times), 6)}, result
+
+
+def run_size(planner, rows, repeat, workdir, seed):
+    xlsx = os.path.join(workdir, f"library_{rows}.xlsx")
+    actual_rows = generate_workbook(planner, xlsx, rows, seed)
+    mapping = planner.DEFAULT_COL_MAPPING
+    sources = [{"path": xlsx, "sheets": None}]
+    result = {"rows": actual_rows, "file_bytes": os.path.getsize(xlsx)}
+
+    def ingest():
+        library = planner.ActionLibrary()
+        library.load(sources)
+        return library
+    result["ingest"], library = measure(ingest, repeat)
+
+    def dedup():
+        entries = []
+        for cat in mapping:
+            if "辅助" in cat or "表情" in cat: continue
+            setting = mapping[cat]
+            cols = setting["cols"] if isinstance(setting, dict) else setting
+            for col in cols:
+                entries.extend((act, cat) for _, act, _ in library.iter_column(col))
+        return planner.ActionDedupIndex().build(entries)
+    result["dedup_index"], _ = measure(dedup, repeat)
+
+    # 抽取数量随动作库规模增长，让计划行数也随之放大
+    target_c = max(planner.DEFAULT_MIN_C, actual_rows // 50)
+    categories = {}
+    translation_map = {}
+
+    def draw():
+        rng = random.Random(seed)
+        for cat in mapping:
+            setting = mapping[cat]
+            cols = setting["cols"] if isinstance(setting, dict) else setting
+            categories[cat] = planner.draw_category(library, cat, cols, target_c, translation_map, rng)
+        return categories
+    result["draw"], _ = measure(draw, repeat)
+
+    order = [k for k in mapping if "辅助" not in k and "表情" not in k]
+    result["plan"], plan = measure(lambda: planner.build_plan(categories, order, translation_map), repeat)
+    result["plan_rows"] = len(plan)
+
+    def edit():
+        rows_copy = [dict(x) for x in plan]
+        for x in rows_copy: x["checked"] = True
+        indices = range(len(rows_copy))
+        planner.plan_add_tag(rows_copy, indices, "masterpiece")
+        planner.plan_remove_tag(rows_copy, indices, "masterpiece")
+        for x in rows_copy[::2]: x["checked"] = False
+        rows_copy = planner.plan_copy_checked(rows_copy)
+        planner.plan_move_checked(rows_copy, -1)
+        planner.plan_move_checked(rows_copy, 1)
+        return rows_copy
+    result["edit"], _ = measure(edit, repeat)
+
+    out_path = os.path.join(workdir, f"plan_{rows}.xlsx")
+    result["export"], _ = measure(lambda: planner.write_plan_xlsx(plan, out_path, random.Random(seed)), repeat)
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="结果 JSON 的保存路径（默认只打印）")
+    args = parser.parse_args()
+
+    planner = load_planner()
+    report = {
+        "benchmark": "planner",
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "seed": args.seed,
+        "results": [],
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        for rows in args.sizes:
+            report["results"].append(run_size(planner, rows, args.repeat, workdir, args.seed))
+            print(f"{rows} 行完成", file=sys.stderr)
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""图片管理工具（图片管理工具.py）Photoshop 批量保存关闭的基准测试。
+
+用本地模拟的 PhotoshopClient 代替真实的 Photoshop（不需要 Windows / pywin32），
+把 PsBatchThread 的 run() 直接在当前线程里同步调用，测量：
+
+    overhead   文档保存耗时为 0 时，每个文档的调度开销
+    simulated  每个文档模拟保存 --delay 秒时的总耗时与逐个文档耗时
+    cancel     处理到一半时取消，从发出取消到线程收尾的延迟
+
+结果以 JSON 输出：
+
+    python benchmarks/bench_ps_batch.py --docs 50 --delay 0.05 --out bench_ps_batch.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import threading
+
+from bench_thumbnails import load_image_tool, git_revision
+
+
+def stub_client_class(tool):
+    """按工具里的 PhotoshopClient 接口实现的本地模拟 PS"""
+    class StubPhotoshopClient(tool.PhotoshopClient):
+        """docs 为打开的文档名，每个文档保存耗时 delay 秒，fail 里的文档模拟保存出错。
+        closed 按顺序记录 (文档名, 是否保存)"""
+        def __init__(self, docs=(), delay=0.0, fail=()):
+            self.docs = list(docs)
+            self.delay = delay
+            self.fail = set(fail)
+            self.dialogs = 1
+            self.closed = []
+
+        def document_count(self):
+            return len(self.docs)
+
+        def suppress_dialogs(self):
+            mode, self.dialogs = self.dialogs, 3
+            return mode
+
+        def restore_dialogs(self, mode):
+            self.dialogs = mode
+
+        def save_and_close_active(self):
+            name = self.docs.pop()
+            if self.delay: time.sleep(self.delay)
+            saved = name not in self.fail
+            self.closed.append((name, saved))
+            return name, "" if saved else "模拟保存失败"
+    return StubPhotoshopClient
+
+
+def run_batch(tool, client):
+    worker = tool.PsBatchThread(lambda: client, client.document_count())
+    result = {}
+    worker.done_signal.connect(lambda finished, failed, cancelled, error: result.update(
+        finished=finished, failed=failed, cancelled=cancelled, error=error or None))
+    t0 = time.perf_counter()
+    worker.run()
+    result["seconds"] = round(time.perf_counter() - t0, 4)
+    return worker, result
+
+
+def bench_overhead(tool, stub, docs):
+    client = stub([f"doc{i}.psd" for i in range(docs)])
+    _, result = run_batch(tool, client)
+    result["per_doc_us"] = round(result["seconds"] / docs * 1e6, 1)
+    return result
+
+
+def bench_simulated(tool, stub, docs, delay):
+    client = stub([f"doc{i}.jpg" for i in range(docs)], delay)
+    worker, result = run_batch(tool, client)
+    times = sorted(t[1] for t in worker.timings)
+    result["per_doc_ms"] = {
+        "median": round(statistics.median(times) * 1000, 2),
+        "max": round(times[-1] * 1000, 2),
+    }
+    return result
+
+
+def bench_cancel(tool, stub, docs, delay):
+    """另开一个线程在处理到一半时调用 stop()，记录到 run() 返回的延迟"""
+    client = stub([f"doc{i}.jpg" for i in range(docs)], delay)
+    worker = tool.PsBatchThread(lambda: client, docs)
+    stopped = {}
+
+    def cancel():
+        time.sleep(delay * docs / 2)
+        stopped["at"] = time.perf_counter()
+        worker.stop()
+    timer = threading.Thread(target=cancel)
+    timer.start()
+    worker.run()
+    latency = time.perf_counter() - stopped.get("at", time.perf_counter())
+    timer.join()
+    return {"processed": len(worker.timings), "remaining": client.document_count(),
+            "cancel_latency_ms": round(latency * 1000, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=50, help="模拟打开的文档数")
+    parser.add_argument("--delay", type=float, default=0.05, help="每个文档模拟的保存耗时（秒）")
+    parser.add_argument("--out", help="结果 JSON 的保存路径（默认只打印）")
+    args = parser.parse_args()
+
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    tool = load_image_tool()
+    stub = stub_client_class(tool)
+    report = {
+        "benchmark": "ps_batch",
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "docs": args.docs,
+        "delay_s": args.delay,
+    }
+    report["overhead"] = bench_overhead(tool, stub, args.docs)
+    report["simulated"] = bench_simulated(tool, stub, args.docs, args.delay)
+    report["cancel"] = bench_cancel(tool, stub, args.docs, args.delay)
+    print("完成", file=sys.stderr)
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""图片管理工具（图片管理工具.py）缩略图解码的基准测试。
+
+对同一批图片分别用两种方式生成缩略图，统计每张图的解码耗时和进程峰值内存：
+
+    legacy   旧做法：整图解码 → 转 RGBA → 全尺寸 LANCZOS 缩放
+    current  decode_thumbnail：JPEG 用 draft() 缩小解码，其余 reduce + LANCZOS，不透明图保持 RGB
+
+每种方式在独立子进程里跑（峰值内存取 resource.getrusage 的 ru_maxrss，
+平台不支持时记为 null），互不影响。不指定 --dir 时生成一批合成图片
+（JPEG 与带透明通道的 PNG 混合）。结果以 JSON 输出：
+
+    python benchmarks/bench_thumbnails.py --count 60 --width 350 --out bench_thumbnails.json
+    python benchmarks/bench_thumbnails.py --dir D:/照片/某文件夹
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import importlib.util
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = ("legacy", "current")
+EXTS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def load_image_tool():
+    spec = importlib.util.spec_from_file_location("image_tool", os.path.join(ROOT, "图片管理工具.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["image_tool"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def decode_legacy(path, target_width):
+    from PIL import Image
+    pil_img = Image.open(path)
+    if pil_img.mode != "RGBA":
+        pil_img = pil_img.convert("RGBA")
+    w, h = pil_img.size
+    if w > target_width * 1.5:
+        pil_img = pil_img.resize((target_width, int(h * target_width / float(w))), Image.Resampling.LANCZOS)
+    return pil_img
+
+
+def generate_images(workdir, count, size, seed=0):
+    """生成 count 张合成图片，每 5 张里有一张带透明通道的 PNG"""
+    from PIL import Image, ImageDraw
+    import random
+
+    rng = random.Random(seed)
+    w, h = size
+    paths = []
+    for i in range(count):
+        dims = (w, h) if i % 2 == 0 else (h, w)
+        img = Image.effect_noise(dims, 40).convert("RGB")
+        draw = ImageDraw.Draw(img)
+        for _ in range(20):
+            x0, y0 = rng.randrange(dims[0]), rng.randrange(dims[1])
+            color = tuple(rng.randrange(256) for _ in range(3))
+            draw.ellipse((x0, y0, x0 + dims[0] // 4, y0 + dims[1] // 4), fill=color)
+        if i % 5 == 0:
+            path = os.path.join(workdir, f"img_{i}.png")
+            img.putalpha(255)
+            img.save(path)
+        else:
+            path = os.path.join(workdir, f"img_{i}.jpg")
+            img.save(path, quality=92)
+        paths.append(path)
+    return paths
+
+
+def run_worker(mode, folder, target_width):
+    """在子进程内执行：逐张解码并输出单行 JSON"""
+    tool = load_image_tool()
+    paths = sorted(os.path.join(folder, f) for f in os.listdir(folder) if f.lower().endswith(EXTS))
+    if mode == "legacy":
+        decode = lambda p: decode_legacy(p, target_width)
+    else:
+        decode = lambda p: tool.decode_thumbnail(p, target_width)[0]
+    baseline = peak_rss_mb()
+    times = []
+    for path in paths:
+        t0 = time.perf_counter()
+        decode(path)
+        times.append(time.perf_counter() - t0)
+    peak = peak_rss_mb()
+    times.sort()
+    print(json.dumps({
+        "mode": mode,
+        "images": len(paths),
+        "total_s": round(sum(times), 4),
+        "per_image_ms": {
+            "mean": round(statistics.mean(times) * 1000, 2) if times else None,
+            "median": round(statistics.median(times) * 1000, 2) if times else None,
+            "max": round(times[-1] * 1000, 2) if times else None,
+        },
+        "peak_rss_mb": peak,
+        "peak_rss_delta_mb": round(peak - baseline, 1) if peak is not None else None,
+    }))
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dir", help="用已有的图片文件夹测试（默认生成合成图片）")
+    parser.add_argument("--count", type=int, default=40, help="合成图片数量")
+    parser.add_argument("--size", default="2048x3072", help="合成图片尺寸，宽x高")
+    parser.add_argument("--width", type=int, default=350, help="缩略图目标宽度")
+    parser.add_argument("--out", help="结果 JSON 的保存路径（默认只打印）")
+    parser.add_argument("--worker", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.dir, args.width)
+        return
+
+    report = {
+        "benchmark": "thumbnails",
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "target_width": args.width,
+        "results": [],
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        folder = args.dir
+        if not folder:
+            size = tuple(int(x) for x in args.size.lower().split("x"))
+            generate_images(workdir, args.count, size)
+            folder = workdir
+            report["synthetic"] = {"count": args.count, "size": args.size}
+        for mode in MODES:
+            out = subprocess.check_output(
+                [sys.executable, os.path.abspath(__file__), "--worker", mode, "--dir", folder, "--width", str(args.width)],
+                text=True, env=dict(os.environ, QT_QPA_PLATFORM=os.environ.get("QT_QPA_PLATFORM", "offscreen")))
+            report["results"].append(json.loads(out.strip().splitlines()[-1]))
+            print(f"{mode} 完成", file=sys.stderr)
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
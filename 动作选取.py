@@ -1,9 +1,20 @@
+import time
+_STARTUP_T0 = time.perf_counter()
 import sys
 import os
 import random
 import traceback
 import json
-import pandas as pd
+import re
+import math
+import pickle
+import heapq
+import functools
+import contextlib
+from collections import deque
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QMainWindow, QPushButton, QListWidget, 
     QTextEdit, QVBoxLayout, QHBoxLayout, QLabel, QFileDialog, 
@@ -13,7 +24,7 @@ from PyQt5.QtWidgets import (
     QTableWidgetItem, QHeaderView, QSpinBox, QGroupBox, QToolButton
 )
 from PyQt5.QtGui import QPalette, QColor, QFont, QCursor
-from PyQt5.QtCore import Qt, pyqtSignal, QSize, QEvent
+from PyQt5.QtCore import Qt, pyqtSignal, QSize, QEvent, QTimer
 
 # --- 常量定义 ---
 RESOLUTION_LIST = [
@@ -44,9 +55,605 @@ DEFAULT_COL_MAPPING = {
   "辅助动作（S/U/W列）": [18, 20, 22],
   "表情（Y列）": [24]
 }
-DEFAULT_MIN_C = 3          
-REPEAT_MIN = 3             
-REPEAT_MAX = 5             
+DEFAULT_MIN_C = 3
+REPEAT_MIN = 3
+REPEAT_MAX = 5
+ALL_SHEETS = "*"           # library_sources 中表示"合并该工作簿全部工作表"
+LIBRARY_CACHE_FILE = "library_cache.pkl"
+LIBRARY_CACHE_VERSION = 1
+# 需要重新解析的来源合计超过这个大小才开进程池：spawn 出的子进程要重新导入 PyQt5/pandas，
+# 两三个普通大小的工作簿串行解析反而更快
+PARALLEL_PARSE_MIN_BYTES = 32 * 1024 * 1024
+
+# pandas/openpyxl 导入很慢，只有真正需要解析或写出工作簿时才导入
+_pandas = None
+def import_pandas():
+    global _pandas
+    if _pandas is None:
+        import pandas
+        _pandas = pandas
+    return _pandas
+
+# --- 动作库加载（多工作簿 / 多工作表合并） ---
+def col_to_index(col):
+    """映射里的列既可以写 0 起始的序号，也可以写 Excel 列字母（"A"、"AC"）"""
+    if isinstance(col, int): return col
+    col = str(col).strip()
+    if col.isdigit(): return int(col)
+    idx = 0
+    for ch in col.upper():
+        idx = idx * 26 + (ord(ch) - ord("A") + 1)
+    return idx - 1
+
+def read_workbook_sheets(path, sheets=None):
+    """解析一个工作簿，返回 [(工作表名, 按列存放的单元格文本)]，空单元格为 None。
+
+    sheets 为 None 时只读第一张表（与旧版一致），为 ALL_SHEETS 时读全部，也可以是表名列表。
+    放在模块顶层、只返回普通 list，方便丢进进程池并行解析。
+    """
+    if sheets is None: sheet_arg = 0
+    elif sheets == ALL_SHEETS: sheet_arg = None
+    else: sheet_arg = list(sheets)
+    pd = import_pandas()
+    frames = pd.read_excel(path, header=None, sheet_name=sheet_arg)
+    if isinstance(frames, pd.DataFrame): frames = {"": frames}
+    result = []
+    for name, df in frames.items():
+        columns = []
+        for col_idx in range(df.shape[1]):
+            cells = []
+            for val in df.iloc[:, col_idx].tolist():
+                if pd.notna(val):
+                    text = str(val).strip()
+                    cells.append(text if text else None)
+                else:
+                    cells.append(None)
+            columns.append(cells)
+        result.append((str(name), columns))
+    return result
+
+def normalize_sources(config):
+    """从配置里取出动作库来源列表；旧配置只有 excel_path 时视为单一来源"""
+    sources = []
+    for src in config.get("library_sources") or []:
+        if isinstance(src, str): src = {"path": src}
+        if src.get("path"): sources.append({"path": src["path"], "sheets": src.get("sheets")})
+    if not sources and config.get("excel_path"):
+        sources.append({"path": config["excel_path"], "sheets": None})
+    return sources
+
+class ActionLibrary:
+    """合并后的动作库。
+
+    每个来源（工作簿 + 工作表选择）单独缓存解析结果，并记录文件的 mtime/大小；
+    重新加载时只解析发生变化的来源，要解析的来源多且大时放到进程池里并行。
+    所有工作表共用同一份列映射，同名的子分类（首行表头）会自然合并。
+    给出 cache_path 时解析结果还会落盘，文件没变的话下次启动连 pandas 都不用导入。
+    """
+    def __init__(self, cache_path=None):
+        self._cache = {}     # (路径, 工作表选择) -> {"sig": 文件签名, "sheets": 解析结果}
+        self.sheets = []     # 按来源顺序排列的 [(显示名, 按列单元格)]
+        self.errors = {}     # 路径 -> 错误信息
+        self.last_parsed = 0 # 最近一次 load 实际解析的来源数
+        self.cache_path = cache_path
+        if cache_path: self._load_disk_cache()
+
+    def _load_disk_cache(self):
+        try:
+            with open(self.cache_path, "rb") as f:
+                payload = pickle.load(f)
+            if payload.get("version") == LIBRARY_CACHE_VERSION:
+                self._cache = payload.get("entries", {})
+        except Exception:
+            self._cache = {}
+
+    def _save_disk_cache(self):
+        if not self.cache_path: return
+        try:
+            tmp_path = self.cache_path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump({"version": LIBRARY_CACHE_VERSION, "entries": self._cache}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.cache_path)
+        except Exception as e: print(f"保存动作库缓存失败: {e}")
+
+    @staticmethod
+    def _source_key(src):
+        sheets = src.get("sheets")
+        if isinstance(sheets, list): sheets = tuple(sheets)
+        return (os.path.abspath(src["path"]), sheets)
+
+    @staticmethod
+    def _file_signature(path):
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+
+    def load(self, sources):
+        """加载/刷新来源，返回本次实际重新解析的来源数"""
+        self.errors = {}
+        keys, stale = [], []
+        for src in sources:
+            key = self._source_key(src)
+            keys.append(key)
+            try: sig = self._file_signature(key[0])
+            except OSError as e:
+                self.errors[src["path"]] = str(e)
+                continue
+            cached = self._cache.get(key)
+            if cached is None or cached["sig"] != sig: stale.append((key, sig))
+
+        parsed = {}
+        if len(stale) > 1 and sum(sig[1] for _, sig in stale) >= PARALLEL_PARSE_MIN_BYTES:
+            try:
+                with ProcessPoolExecutor(max_workers=min(len(stale), os.cpu_count() or 1)) as pool:
+                    futures = {key: pool.submit(read_workbook_sheets, key[0], key[1]) for key, _ in stale}
+                    for key, fut in futures.items():
+                        # 子进程意外退出算进程池的问题，留给下面串行重试；文件本身解析失败就直接记错误
+                        try: parsed[key] = fut.result()
+                        except BrokenProcessPool: pass
+                        except Exception as e: self.errors[key[0]] = str(e)
+            except Exception:
+                # 进程池起不来时退回串行解析
+                pass
+        for key, _ in stale:
+            if key in parsed or key[0] in self.errors: continue
+            try: parsed[key] = read_workbook_sheets(key[0], key[1])
+            except Exception as e: self.errors[key[0]] = str(e)
+        for key, sig in stale:
+            if key in parsed: self._cache[key] = {"sig": sig, "sheets": parsed[key]}
+        if parsed: self._save_disk_cache()
+
+        self.sheets = []
+        for key in keys:
+            cached = self._cache.get(key)
+            if cached is None: continue
+            base = os.path.basename(key[0])
+            for name, columns in cached["sheets"]:
+                self.sheets.append((f"{base}:{name}" if name else base, columns))
+        self.last_parsed = len(parsed)
+        return self.last_parsed
+
+    def retain(self, sources):
+        """丢弃不再使用的来源缓存（确认新来源加载成功后再调用）"""
+        keys = {self._source_key(src) for src in sources}
+        dropped = [key for key in self._cache if key not in keys]
+        for key in dropped: del self._cache[key]
+        if dropped: self._save_disk_cache()
+
+    def is_empty(self): return not self.sheets
+
+    def iter_column(self, col_idx):
+        """依次产出 (子分类, 动作, 翻译)；翻译取同一工作表中右侧相邻的列"""
+        for _, columns in self.sheets:
+            if col_idx >= len(columns): continue
+            col_data = columns[col_idx]
+            if not col_data: continue
+            trans_data = columns[col_idx + 1] if col_idx + 1 < len(columns) else None
+            sub_cat = col_data[0] if col_data[0] is not None else "nan"
+            for i in range(1, len(col_data)):
+                act = col_data[i]
+                if not act: continue
+                t_str = ""
+                if trans_data is not None and i < len(trans_data) and trans_data[i]:
+                    t_str = trans_data[i]
+                    if t_str.lower() == 'nan': t_str = ""
+                yield sub_cat, act, t_str
+
+# --- 重复 / 近似重复动作检测 ---
+NEAR_DUP_THRESHOLD = 0.8   # 规范化标签集合的 Jaccard 相似度达到该值即视为近似重复
+_TAG_SPLIT_RE = re.compile(r"[,，]")
+_TAG_WEIGHT_RE = re.compile(r":\s*-?[\d.]+\s*(?=[)\]}]*$)")
+_TAG_SPACE_RE = re.compile(r"[\s_]+")
+
+def canonical_tags(text):
+    """把一条动作 prompt 规范化为标签集合：小写、去权重/括号、统一空格与下划线"""
+    tags = set()
+    for part in _TAG_SPLIT_RE.split(text):
+        tag = part.strip().lower()
+        if ":" in tag: tag = _TAG_WEIGHT_RE.sub("", tag)
+        tag = tag.strip("()[]{} ")
+        if "_" in tag or "  " in tag: tag = _TAG_SPACE_RE.sub(" ", tag)
+        if tag: tags.add(tag)
+    return frozenset(tags)
+
+class ActionDedupIndex:
+    """跨分类的动作查重索引。
+
+    完全重复：规范化后的标签集合相同；近似重复：标签集合的 Jaccard 相似度 ≥ threshold。
+    近似重复用前缀过滤找候选（按全局词频把稀有标签排在前面，相似度达标的两个集合
+    必然在各自前若干个标签里有交集），再用真实 Jaccard 确认，结果精确且基本是线性的。
+    重复与近似重复的动作会被并到同一个簇，抽取时按簇去重即可保证跨分类不出现实质相同的动作。
+    """
+    def __init__(self, threshold=NEAR_DUP_THRESHOLD):
+        self.threshold = threshold
+        self._canon = {}        # 动作 -> 规范化标签集合
+        self._locations = {}    # 标签集合 -> [(动作, 分类/子分类)]
+        self._parent = {}       # 并查集：标签集合 -> 父节点
+        self._similar = {}      # 簇内近似重复的最低相似度，供展示
+
+    def _find(self, x):
+        root = x
+        while self._parent[root] != root: root = self._parent[root]
+        while self._parent[x] != root: self._parent[x], x = root, self._parent[x]
+        return root
+
+    def _union(self, a, b, sim):
+        ra, rb = self._find(a), self._find(b)
+        low = min(self._similar.pop(ra, 1.0), sim)
+        if ra != rb:
+            low = min(low, self._similar.pop(rb, 1.0))
+            self._parent[rb] = ra
+        self._similar[ra] = low
+
+    def build(self, entries):
+        """entries: 可迭代的 (动作, 位置描述)"""
+        for act, location in entries:
+            tags = self._canon.get(act)
+            if tags is None:
+                tags = canonical_tags(act)
+                self._canon[act] = tags
+            if not tags: continue
+            self._locations.setdefault(tags, []).append((act, location))
+            self._parent.setdefault(tags, tags)
+
+        freq = {}
+        for tags in self._locations:
+            for tok in tags: freq[tok] = freq.get(tok, 0) + 1
+        prefix_index = {}       # 标签 -> 以它为前缀标签的集合（按集合大小递增加入）
+        for tags in sorted(self._locations, key=len):
+            ordered = sorted(tags, key=lambda t: (freq[t], t))
+            prefix_len = len(ordered) - math.ceil(self.threshold * len(ordered)) + 1
+            min_len = self.threshold * len(ordered)
+            seen = set()
+            for tok in ordered[:prefix_len]:
+                bucket = prefix_index.setdefault(tok, [])
+                for other in bucket:
+                    if other in seen or len(other) < min_len: continue
+                    seen.add(other)
+                    sim = len(tags & other) / len(tags | other)
+                    if sim >= self.threshold: self._union(other, tags, sim)
+                bucket.append(tags)
+        return self
+
+    def cluster_id(self, act):
+        tags = self._canon.get(act)
+        if tags is None: tags = canonical_tags(act)
+        if tags in self._parent: return self._find(tags)
+        return tags
+
+    def groups(self):
+        """返回 [(类型, 最低相似度, [(动作, 位置), ...])]，只包含有重复的簇"""
+        clusters = {}
+        for tags, locs in self._locations.items():
+            clusters.setdefault(self._find(tags), []).append(tags)
+        result = []
+        for root, members in clusters.items():
+            locs = [loc for tags in members for loc in self._locations[tags]]
+            if len(locs) < 2: continue
+            kind = "近似重复" if len(members) > 1 else "完全重复"
+            result.append((kind, self._similar.get(root, 1.0) if len(members) > 1 else 1.0, locs))
+        result.sort(key=lambda g: (g[0] != "完全重复", -len(g[2])))
+        return result
+
+# --- 抽取与计划生成（不依赖界面，基准测试直接调用） ---
+def empty_category_data(cat_name):
+    if "表情" in cat_name: return []
+    return {}
+
+def draw_category(library, cat_name, col_indices, target_c_count=DEFAULT_MIN_C, translation_map=None, rng=random,
+                  dedup_index=None, used_clusters=None):
+    """从动作库中为一个分类抽取动作。
+
+    表情类返回动作列表，辅助类返回 {子分类: {动作: 1}}，其余返回
+    {子分类: [{动作: 重复次数}, ...]}；顺带把翻译写入 translation_map。
+    同时给出 dedup_index 与 used_clusters 时，跳过已被其它分类抽中的（近似）重复动作，
+    并把本次抽中的簇加入 used_clusters。
+    """
+    is_aux = "辅助" in cat_name
+    is_emo = "表情" in cat_name
+    data = empty_category_data(cat_name)
+    if library is None: return data
+    if translation_map is None: translation_map = {}
+
+    all_actions_pool = [] 
+    for col_idx in col_indices:
+        for sub_cat, act, t_str in library.iter_column(col_idx):
+            all_actions_pool.append((act, sub_cat))
+            if t_str: translation_map[act] = t_str
+    if not all_actions_pool: return data
+
+    if is_emo: 
+        return [x[0] for x in all_actions_pool]
+    elif is_aux: 
+        for act, sub in all_actions_pool:
+            if sub not in data:
+                data[sub] = {}
+            data[sub][act] = 1
+    else:
+        final_selection = []
+        shuffled_pool = all_actions_pool.copy()
+        rng.shuffle(shuffled_pool)
+        unique_actions = {} 
+        for a, s in shuffled_pool:
+            if a not in unique_actions: unique_actions[a] = s
+        unique_keys = list(unique_actions.keys())
+        if dedup_index is None or used_clusters is None:
+            count_to_take = min(target_c_count, len(unique_keys))
+            selected_keys = unique_keys[:count_to_take]
+        else:
+            selected_keys = []
+            for act in unique_keys:
+                if len(selected_keys) >= target_c_count: break
+                cid = dedup_index.cluster_id(act)
+                if cid in used_clusters: continue
+                used_clusters.add(cid)
+                selected_keys.append(act)
+
+        for act in selected_keys:
+            sub = unique_actions[act]
+            repeat = rng.randint(REPEAT_MIN, REPEAT_MAX)
+            final_selection.append({'action': act, 'count': repeat, 'sub': sub})
+        for _, sub in all_actions_pool:
+            if sub not in data:
+                data[sub] = []
+        for item in final_selection:
+            data[item['sub']].append({item['action']: item['count']})
+    return data
+
+def new_plan_row(action, translation_map):
+    return {
+        "original_action": action, 
+        "translation": translation_map.get(action, "无标签"), 
+        "checked": False,
+        "image_size": None 
+    }
+
+def build_plan(action_categories, order, translation_map):
+    """按分类顺序把抽取结果展开成计划行（每张图一行）"""
+    plan = []
+    for cat_name in order:
+        data = action_categories.get(cat_name)
+        if not isinstance(data, dict): continue
+        for acts_list in data.values():
+            if not isinstance(acts_list, list): continue
+            for action_group in acts_list:
+                for action, count in action_group.items():
+                    row = new_plan_row(action, translation_map)
+                    plan.extend(dict(row) for _ in range(count))
+    return plan
+
+def plan_add_tag(plan, indices, text):
+    for i in indices:
+        orig = plan[i]["original_action"]
+        plan[i]["original_action"] = f"{text}, {orig}" if not orig.startswith(",") else f"{text}{orig}"
+
+def plan_remove_tag(plan, indices, text):
+    for i in indices:
+        parts = [p.strip() for p in plan[i]["original_action"].split(',')]
+        plan[i]["original_action"] = ", ".join(p for p in parts if p != text)
+
+def plan_move_checked(plan, direction):
+    """勾选的行整体上移(-1)/下移(1)一格，返回是否有行移动"""
+    indices = [i for i, x in enumerate(plan) if x["checked"]]
+    moved = False
+    if direction == -1: 
+        for i in indices:
+            if i > 0 and not plan[i-1]["checked"]:
+                plan[i], plan[i-1] = plan[i-1], plan[i]; moved = True
+    else: 
+        for i in reversed(indices):
+            if i < len(plan) - 1 and not plan[i+1]["checked"]:
+                plan[i], plan[i+1] = plan[i+1], plan[i]; moved = True
+    return moved
+
+def plan_copy_checked(plan):
+    """在每个勾选行后面插入一份副本（副本保持勾选），返回新的计划"""
+    result = []
+    for row in plan:
+        result.append(row)
+        if row["checked"]:
+            new_item = row.copy()
+            new_item['checked'] = True
+            result.append(new_item)
+    return result
+
+def plan_image_sizes(plan):
+    sizes = []
+    for x in plan:
+        raw_size = x.get('image_size')
+        if raw_size:
+            # 提取 "SDXL_1024x960" 后面的 "1024x960"
+            parts = raw_size.split('_', 1)
+            sizes.append(parts[1] if len(parts) > 1 else raw_size)
+        else:
+            sizes.append(DEFAULT_RESOLUTION)
+    return sizes
+
+def write_plan_xlsx(plan, path, rng=random):
+    """把计划写成 ComfyUI 批处理用的表格；文件被占用时抛出 PermissionError"""
+    final = [x["original_action"] for x in plan]
+    seeds = [str(rng.randint(10000000000000, 99999999999999)) for _ in final]
+    sizes = plan_image_sizes(plan)
+    pd = import_pandas()
+
+    # 列顺序: 1 完成情况, 2 序号, 3 动作Prompt, 4 种子, 5 图像大小
+    df = pd.DataFrame({
+        "完成情况": [""] * len(final),
+        "序号": range(1, len(final)+1),
+        "动作Prompt": final,
+        "种子": seeds,
+        "图像大小": sizes
+    })
+    
+    with pd.ExcelWriter(path, engine='openpyxl') as writer:
+        df.to_excel(writer, index=False, sheet_name='Sheet1')
+        ws = writer.sheets['Sheet1']
+        
+        # 调整列宽
+        ws.column_dimensions['A'].width = 15 # 完成情况
+        ws.column_dimensions['B'].width = 8  # 序号
+        ws.column_dimensions['C'].width = 50 # Prompt
+        ws.column_dimensions['D'].width = 25 # 种子
+        ws.column_dimensions['E'].width = 15 # 图像大小
+        
+        # 种子列（第4列）设置文本格式
+        for row in range(2, len(final) + 2):
+            cell = ws.cell(row=row, column=4)
+            cell.number_format = '@' 
+
+# --- 渲染成本估算 ---
+DEFAULT_SEC_PER_MP = {"SDXL": 5.0, "2K": 8.0}   # 每百万像素的渲染秒数，可在界面里按本机实测校准
+
+@functools.lru_cache(maxsize=None)
+def parse_resolution(size):
+    """"SDXL_832x1216" -> ("SDXL", 832, 1216)；未设置时按 DEFAULT_RESOLUTION 处理"""
+    size = size or DEFAULT_RESOLUTION
+    bucket, _, dims = size.rpartition("_")
+    if not bucket:
+        bucket = next((r.split("_", 1)[0] for r in RESOLUTION_LIST if r.endswith("_" + dims)), "SDXL")
+    w, _, h = dims.partition("x")
+    return bucket, int(w), int(h)
+
+class RenderCostModel:
+    """按分辨率档位累计计划的张数与像素数，估算渲染耗时。
+
+    行的增删、改分辨率都以增量方式更新，不需要每次遍历整个计划。
+    """
+    def __init__(self, sec_per_mp=None):
+        self.sec_per_mp = dict(DEFAULT_SEC_PER_MP)
+        if sec_per_mp: self.sec_per_mp.update(sec_per_mp)
+        self.buckets = {}    # 档位 -> [张数, 像素数]
+
+    def _apply(self, size, n):
+        bucket, w, h = parse_resolution(size)
+        stat = self.buckets.setdefault(bucket, [0, 0])
+        stat[0] += n
+        stat[1] += n * w * h
+        if stat[0] == 0: del self.buckets[bucket]
+
+    def rebuild(self, plan):
+        self.buckets = {}
+        self.add(plan)
+
+    def add(self, rows):
+        for row in rows: self._apply(row.get("image_size"), 1)
+
+    def remove(self, rows):
+        for row in rows: self._apply(row.get("image_size"), -1)
+
+    def change_size(self, rows, new_size):
+        for row in rows:
+            self._apply(row.get("image_size"), -1)
+            self._apply(new_size, 1)
+
+    def row_seconds(self, row):
+        bucket, w, h = parse_resolution(row.get("image_size"))
+        return w * h / 1e6 * self.sec_per_mp.get(bucket, 0.0)
+
+    def breakdown(self):
+        """[(档位, 张数, 百万像素, 秒)]"""
+        return [(b, n, px / 1e6, px / 1e6 * self.sec_per_mp.get(b, 0.0)) for b, (n, px) in sorted(self.buckets.items())]
+
+    def images(self): return sum(n for n, _ in self.buckets.values())
+
+    def seconds(self): return sum(sec for _, _, _, sec in self.breakdown())
+
+def fit_plan_to_budget(plan, model, budget_seconds):
+    """删减重复次数直到预计耗时不超过预算。
+
+    每次从当前重复最多的动作（同样多时先删单张更贵的）去掉最后一张，每个动作至少保留一张。
+    返回 (新计划, 被删掉的行)；实在删不到预算以内时返回能做到的最小计划。
+    """
+    total = model.seconds()
+    if total <= budget_seconds: return plan, []
+    groups = {}
+    for i, row in enumerate(plan): groups.setdefault(row["original_action"], []).append(i)
+    heap = [(-len(idx), -model.row_seconds(plan[idx[-1]]), act) for act, idx in groups.items()]
+    heapq.heapify(heap)
+    removed = set()
+    while heap and total > budget_seconds:
+        neg_len, _, act = heapq.heappop(heap)
+        idx = groups[act]
+        if len(idx) <= 1: break
+        i = idx.pop()
+        removed.add(i)
+        total -= model.row_seconds(plan[i])
+        heapq.heappush(heap, (-len(idx), -model.row_seconds(plan[idx[-1]]), act))
+    return [row for i, row in enumerate(plan) if i not in removed], [plan[i] for i in sorted(removed)]
+
+# --- 性能统计 ---
+class PerfStats:
+    """热点函数耗时统计：每个函数保留最近 window 次调用的耗时（毫秒），用来算 p50/p95"""
+    def __init__(self, window=500):
+        self.enabled = False
+        self.window = window
+        self.samples = {}    # 名称 -> deque[毫秒]
+        self.counts = {}     # 名称 -> 累计调用次数
+
+    def configure(self, cfg):
+        cfg = cfg or {}
+        self.enabled = bool(cfg.get("enabled", False))
+        window = int(cfg.get("window", self.window))
+        if window != self.window:
+            self.window = window
+            self.samples = {k: deque(v, maxlen=window) for k, v in self.samples.items()}
+
+    def record(self, name, ms):
+        if name not in self.samples: self.samples[name] = deque(maxlen=self.window)
+        self.samples[name].append(ms)
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    @contextlib.contextmanager
+    def span(self, name):
+        """只给 with 块里的那段工作计时；界面处理函数里的对话框等待不应算进去"""
+        if not self.enabled:
+            yield
+            return
+        t0 = time.perf_counter()
+        try: yield
+        finally: self.record(name, (time.perf_counter() - t0) * 1000.0)
+
+    def reset(self):
+        self.samples.clear()
+        self.counts.clear()
+
+    @staticmethod
+    def _percentile(sorted_vals, pct):
+        if not sorted_vals: return 0.0
+        rank = max(0, min(len(sorted_vals) - 1, math.ceil(pct / 100.0 * len(sorted_vals)) - 1))
+        return sorted_vals[rank]
+
+    def summary(self):
+        rows = []
+        for name, vals in self.samples.items():
+            ordered = sorted(vals)
+            rows.append({
+                "name": name, "count": self.counts.get(name, 0),
+                "p50": self._percentile(ordered, 50), "p95": self._percentile(ordered, 95),
+                "max": ordered[-1] if ordered else 0.0, "last": vals[-1] if vals else 0.0,
+            })
+        rows.sort(key=lambda r: r["p95"], reverse=True)
+        return rows
+
+    def dump(self):
+        lines = [f"{'函数':<24}{'次数':>8}{'p50(ms)':>12}{'p95(ms)':>12}{'max(ms)':>12}"]
+        for r in self.summary():
+            lines.append(f"{r['name']:<24}{r['count']:>8}{r['p50']:>12.2f}{r['p95']:>12.2f}{r['max']:>12.2f}")
+        return "\n".join(lines)
+
+PERF = PerfStats()
+
+def timed(name=None):
+    """给热点函数计时；统计关闭时只多一次布尔判断"""
+    def decorator(func):
+        label = name or func.__name__
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not PERF.enabled: return func(*args, **kwargs)
+            t0 = time.perf_counter()
+            try: return func(*args, **kwargs)
+            finally: PERF.record(label, (time.perf_counter() - t0) * 1000.0)
+        return wrapper
+    return decorator
 
 # --- UI 主题设置 ---
 def set_light_theme(app: QApplication):
@@ -210,15 +817,18 @@ class MainWindow(QMainWindow):
         self.app = app
         self.dark_mode = False
         
-        self.excel_data = None
+        self.library = None
         self.current_excel_path = None
         self.translation_map = {}
         self.combined_plan = [] 
         
         self.base_dir = os.path.dirname(os.path.abspath(__file__))
+        self.action_library = ActionLibrary(os.path.join(self.base_dir, LIBRARY_CACHE_FILE))
         
         self.config_data = self.load_config()
+        PERF.configure(self.config_data.get("perf_instrumentation"))
         self.col_mapping = self.config_data.get("mapping", DEFAULT_COL_MAPPING)
+        self.library_sources = normalize_sources(self.config_data)
         
         self.action_categories = {}
         for k in self.col_mapping.keys():
@@ -228,21 +838,38 @@ class MainWindow(QMainWindow):
             
         self.category_widgets = {} 
         self.use_original_text = False
+        self.dedup_index = None
+        self.cost_model = RenderCostModel(self.config_data.get("render_cost", {}).get("sec_per_mp"))
+        self.cross_category_unique = bool(self.config_data.get("cross_category_unique", False))
 
         self.init_ui()
-        
-        saved_path = self.config_data.get("excel_path", "")
-        if saved_path and os.path.exists(saved_path):
-            self.load_excel_file(saved_path)
+        if self.library_sources: self.file_label.setText("正在加载动作库...")
+
+    def load_saved_library(self):
+        """窗口显示之后再加载上次的动作库，并报告启动各阶段耗时"""
+        self.app.processEvents()
+        shown_ms = (time.perf_counter() - _STARTUP_T0) * 1000.0
+        if any(os.path.exists(src["path"]) for src in self.library_sources):
+            self.load_library()
         else:
             self.file_label.setText("请选择 Excel 文件")
+        ready_ms = (time.perf_counter() - _STARTUP_T0) * 1000.0
+        if PERF.enabled:
+            PERF.record("startup.window_shown", shown_ms)
+            PERF.record("startup.library_ready", ready_ms)
+        msg = f"启动耗时: 窗口 {shown_ms:.0f} ms, 动作库就绪 {ready_ms:.0f} ms"
+        if self.library is not None and self.action_library.last_parsed == 0: msg += " (命中解析缓存)"
+        self.statusBar().showMessage(msg, 8000)
 
     def load_config(self):
         config_path = os.path.join(self.base_dir, "config.json")
         default_config = {
             "excel_path": "",
+            "library_sources": [],
             "mapping": DEFAULT_COL_MAPPING,
-            "last_export_dir": "" 
+            "last_export_dir": "",
+            "perf_instrumentation": {"enabled": False, "window": 500},
+            "render_cost": {"sec_per_mp": DEFAULT_SEC_PER_MP, "gpu_budget_hours": 0}
         }
         if os.path.exists(config_path):
             try:
@@ -257,11 +884,13 @@ class MainWindow(QMainWindow):
     def save_config(self):
         config_path = os.path.join(self.base_dir, "config.json")
         last_export = self.config_data.get("last_export_dir", "")
-        data = {
+        data = dict(self.config_data)
+        data.update({
             "excel_path": self.current_excel_path if self.current_excel_path else "",
+            "library_sources": self.library_sources,
             "mapping": self.col_mapping,
             "last_export_dir": last_export
-        }
+        })
         try:
             with open(config_path, "w", encoding="utf-8") as f:
                 json.dump(data, f, indent=4, ensure_ascii=False)
@@ -278,7 +907,7 @@ class MainWindow(QMainWindow):
         elif isinstance(setting, list):
             final_cols = setting
             final_min_c = DEFAULT_MIN_C
-        return final_cols, final_min_c
+        return [col_to_index(c) for c in final_cols], final_min_c
 
     def init_ui(self):
         self.setWindowTitle("动作训练计划生成器 (Modern UI)")
@@ -291,10 +920,15 @@ class MainWindow(QMainWindow):
         main_layout.setSpacing(15)
 
         top_bar = QHBoxLayout()
+        self.perf_btn = QPushButton("⏱ 性能统计")
+        self.perf_btn.setToolTip("查看热点函数的调用次数与 p50/p95 耗时 (config.json: perf_instrumentation.enabled)")
+        self.perf_btn.clicked.connect(self.open_perf_panel)
+        self.perf_btn.setVisible(PERF.enabled)
         self.theme_btn = QPushButton("切换深色 / 浅色模式")
         self.theme_btn.clicked.connect(self.toggle_theme)
         self.lang_toggle = QCheckBox("左侧显示原始Prompt")
         self.lang_toggle.stateChanged.connect(self.toggle_language_display)
+        top_bar.addWidget(self.perf_btn)
         top_bar.addStretch()
         top_bar.addWidget(self.lang_toggle)
         top_bar.addWidget(self.theme_btn)
@@ -314,8 +948,12 @@ class MainWindow(QMainWindow):
         self.file_label.setStyleSheet("color: #909399; font-style: italic;")
         btn_open = QPushButton("更改 Excel")
         btn_open.clicked.connect(self.change_excel_path)
+        btn_merge = QPushButton("＋ 合并工作簿")
+        btn_merge.setToolTip("把另一个工作簿（或其中的工作表）按同一列映射合并进动作库")
+        btn_merge.clicked.connect(self.add_library_source)
         file_layout.addWidget(self.file_label)
         file_layout.addWidget(btn_open)
+        file_layout.addWidget(btn_merge)
         left_layout.addLayout(file_layout)
 
         ctrl_layout = QHBoxLayout()
@@ -330,14 +968,26 @@ class MainWindow(QMainWindow):
         btn_reset = QPushButton("重置所有")
         btn_reset.clicked.connect(self.reset_all_actions)
         btn_gen = QPushButton("生成 Prompt")
-        btn_gen.clicked.connect(self.generate_plan)
+        btn_gen.clicked.connect(lambda: self.generate_plan())
         btn_gen.setStyleSheet("background-color: #409EFF; color: white; border-color: #409EFF; font-weight: bold;")
         
         btn_export = QPushButton("导出 Excel")
-        btn_export.clicked.connect(self.export_excel)
+        btn_export.clicked.connect(lambda: self.export_excel())
+
+        dup_row = QHBoxLayout()
+        self.chk_unique = QCheckBox("跨类别去重")
+        self.chk_unique.setToolTip("抽取时跳过其它分类已抽中的重复/近似重复动作")
+        self.chk_unique.setChecked(self.cross_category_unique)
+        self.chk_unique.stateChanged.connect(self.toggle_cross_category_unique)
+        self.btn_dup = QPushButton("查重")
+        self.btn_dup.clicked.connect(self.open_duplicate_report)
+        dup_row.addWidget(self.chk_unique)
+        dup_row.addWidget(self.btn_dup)
+
         btn_box.addWidget(btn_reset)
         btn_box.addWidget(btn_gen)
         btn_box.addWidget(btn_export)
+        btn_box.addLayout(dup_row)
         
         ctrl_layout.addWidget(self.cat_list, 1)
         ctrl_layout.addLayout(btn_box, 1)
@@ -448,6 +1098,21 @@ class MainWindow(QMainWindow):
         
         right_layout.addWidget(self.prompt_table)
 
+        cost_bar = QHBoxLayout()
+        self.cost_label = QLabel("预计渲染: 0 张")
+        self.cost_label.setStyleSheet("color: #606266; font-weight: bold; padding: 3px;")
+        btn_calib = QPushButton("校准耗时")
+        btn_calib.setToolTip("用本机一次实测的渲染耗时校准每百万像素秒数")
+        btn_calib.clicked.connect(self.calibrate_render_cost)
+        btn_fit = QPushButton("按预算裁剪")
+        btn_fit.setToolTip("减少重复次数，使预计耗时不超过给定的 GPU 小时数")
+        btn_fit.clicked.connect(self.fit_plan_to_budget)
+        cost_bar.addWidget(self.cost_label)
+        cost_bar.addStretch()
+        cost_bar.addWidget(btn_calib)
+        cost_bar.addWidget(btn_fit)
+        right_layout.addLayout(cost_bar)
+
         left_panel.setMinimumWidth(600) 
         splitter.addWidget(left_panel)
         splitter.addWidget(right_panel)
@@ -457,6 +1122,59 @@ class MainWindow(QMainWindow):
 
     # --- 逻辑功能 ---
 
+    def open_perf_panel(self):
+        dialog = QDialog(self)
+        dialog.setWindowTitle("性能统计")
+        dialog.resize(720, 420)
+        layout = QVBoxLayout(dialog)
+        table = QTableWidget()
+        table.setColumnCount(6)
+        table.setHorizontalHeaderLabels(["函数", "次数", "p50 (ms)", "p95 (ms)", "max (ms)", "最近 (ms)"])
+        table.verticalHeader().setVisible(False)
+        table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        layout.addWidget(table)
+
+        def fill():
+            rows = PERF.summary()
+            table.setRowCount(len(rows))
+            for r, row in enumerate(rows):
+                values = [row["name"], str(row["count"])] + [f"{row[k]:.2f}" for k in ("p50", "p95", "max", "last")]
+                for c, val in enumerate(values):
+                    cell = QTableWidgetItem(val)
+                    if c > 0: cell.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                    table.setItem(r, c, cell)
+
+        btn_layout = QHBoxLayout()
+        btn_refresh = QPushButton("刷新"); btn_refresh.clicked.connect(fill)
+        btn_reset = QPushButton("清零"); btn_reset.clicked.connect(lambda: (PERF.reset(), fill()))
+        btn_copy = QPushButton("复制文本"); btn_copy.clicked.connect(lambda: QApplication.clipboard().setText(PERF.dump()))
+        btn_log = QPushButton("写入日志")
+        def write_log():
+            path = self.dump_perf_log()
+            if path: QMessageBox.information(dialog, "完成", f"已追加到:\n{path}")
+        btn_log.clicked.connect(write_log)
+        for b in (btn_refresh, btn_reset, btn_copy, btn_log): btn_layout.addWidget(b)
+        btn_layout.addStretch()
+        layout.addLayout(btn_layout)
+        fill()
+        dialog.exec_()
+
+    def dump_perf_log(self):
+        if not PERF.samples: return None
+        path = os.path.join(self.base_dir, "perf_log.txt")
+        try:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(f"===== {time.strftime('%Y-%m-%d %H:%M:%S')} =====\n{PERF.dump()}\n\n")
+            return path
+        except Exception as e:
+            print(f"写入性能日志失败: {e}")
+            return None
+
+    def closeEvent(self, event):
+        if PERF.enabled: self.dump_perf_log()
+        super().closeEvent(event)
+
     def set_image_size(self):
         indices = [i for i, x in enumerate(self.combined_plan) if x["checked"]]
         if not indices:
@@ -469,10 +1187,58 @@ class MainWindow(QMainWindow):
         )
         
         if ok and item:
+            self.cost_model.change_size([self.combined_plan[i] for i in indices], item)
             for i in indices:
                 self.combined_plan[i]['image_size'] = item
+            self.update_cost_display()
             QMessageBox.information(self, "成功", f"已将选中的 {len(indices)} 个 Prompt 设置为 {item}")
 
+    def update_cost_display(self):
+        seconds = self.cost_model.seconds()
+        hours, rem = divmod(int(round(seconds)), 3600)
+        self.cost_label.setText(f"预计渲染: {self.cost_model.images()} 张 · 约 {hours}h {rem // 60:02d}m ({seconds / 3600:.2f} GPU小时)")
+        lines = [f"{b}: {n} 张, {mp:.1f} MP, {sec / 60:.1f} 分钟 ({self.cost_model.sec_per_mp.get(b, 0):.2f} 秒/MP)"
+                 for b, n, mp, sec in self.cost_model.breakdown()]
+        self.cost_label.setToolTip("\n".join(lines) if lines else "计划为空")
+
+    def save_render_cost_config(self, **kwargs):
+        cfg = dict(self.config_data.get("render_cost", {}))
+        cfg["sec_per_mp"] = dict(self.cost_model.sec_per_mp)
+        cfg.update(kwargs)
+        self.config_data["render_cost"] = cfg
+        self.save_config()
+
+    def calibrate_render_cost(self):
+        size, ok = QInputDialog.getItem(self, "校准耗时", "实测时使用的分辨率:", RESOLUTION_LIST, 2, False)
+        if not ok: return
+        count, ok = QInputDialog.getInt(self, "校准耗时", "实测渲染的张数:", 10, 1, 100000)
+        if not ok: return
+        seconds, ok = QInputDialog.getDouble(self, "校准耗时", "总耗时 (秒):", 60.0, 0.1, 1e7, 1)
+        if not ok: return
+        bucket, w, h = parse_resolution(size)
+        self.cost_model.sec_per_mp[bucket] = seconds / (count * w * h / 1e6)
+        self.save_render_cost_config()
+        self.update_cost_display()
+        QMessageBox.information(self, "完成", f"{bucket}: {self.cost_model.sec_per_mp[bucket]:.2f} 秒/百万像素")
+
+    def fit_plan_to_budget(self):
+        if not self.combined_plan: return
+        default_hours = self.config_data.get("render_cost", {}).get("gpu_budget_hours") or round(self.cost_model.seconds() / 3600, 2)
+        hours, ok = QInputDialog.getDouble(self, "按预算裁剪", "GPU 时间预算 (小时):", default_hours, 0.01, 10000, 2)
+        if not ok: return
+        new_plan, removed = fit_plan_to_budget(self.combined_plan, self.cost_model, hours * 3600)
+        self.save_render_cost_config(gpu_budget_hours=hours)
+        if not removed:
+            QMessageBox.information(self, "提示", "当前计划已在预算以内")
+            return
+        self.cost_model.remove(removed)
+        self.combined_plan = new_plan
+        self.refresh_prompt_list()
+        if self.cost_model.seconds() > hours * 3600:
+            QMessageBox.warning(self, "提示", f"已删去 {len(removed)} 张，但每个动作只剩一张，仍超出预算")
+        else:
+            QMessageBox.information(self, "完成", f"已删去 {len(removed)} 张重复图")
+
     def select_dragged_rows(self):
         selected_indexes = self.prompt_table.selectedIndexes()
         if not selected_indexes: return
@@ -489,11 +1255,7 @@ class MainWindow(QMainWindow):
         if ok and text:
             text = text.strip()
             if not text: return
-            for i in indices:
-                orig = self.combined_plan[i]["original_action"]
-                parts = [p.strip() for p in orig.split(',')]
-                new_parts = [p for p in parts if p != text]
-                self.combined_plan[i]["original_action"] = ", ".join(new_parts)
+            plan_remove_tag(self.combined_plan, indices, text)
             self.refresh_prompt_list()
 
     def open_prompt_editor(self, row, column):
@@ -549,80 +1311,126 @@ class MainWindow(QMainWindow):
         path, _ = QFileDialog.getOpenFileName(self, "选择Excel文件", start_dir, "Excel Files (*.xlsx)")
         if path: self.load_excel_file(path)
 
-    def load_excel_file(self, path):
+    def add_library_source(self):
+        start_dir = os.path.dirname(self.current_excel_path) if self.current_excel_path else self.base_dir
+        path, _ = QFileDialog.getOpenFileName(self, "选择要合并的Excel文件", start_dir, "Excel Files (*.xlsx)")
+        if not path: return
         try:
-            self.current_excel_path = path
-            self.save_config()
-            self.excel_data = pd.read_excel(path, header=None)
-            self.translation_map = {}
-            for cat in self.col_mapping.keys():
-                _, min_c = self.parse_config_setting(cat)
-                self.process_category_data(cat, target_c_count=min_c)
-            self.update_ui_display()
-            self.file_label.setText(os.path.basename(path))
+            # 用完立即关闭，否则 Windows 上工作簿会一直被占用
+            with import_pandas().ExcelFile(path) as xf: sheet_names = xf.sheet_names
         except Exception as e:
             QMessageBox.critical(self, "错误", f"无法读取文件: {str(e)}")
+            return
+        all_label = "（全部工作表）"
+        item, ok = QInputDialog.getItem(self, "选择工作表", "合并哪张工作表：", sheet_names + [all_label], 0, False)
+        if not ok: return
+        sheets = ALL_SHEETS if item == all_label else [item]
+        sources = [s for s in self.library_sources if os.path.abspath(s["path"]) != os.path.abspath(path)]
+        sources.append({"path": path, "sheets": sheets})
+        self.load_library(sources)
 
-    def process_category_data(self, cat_name, target_c_count=DEFAULT_MIN_C):
-        col_indices, _ = self.parse_config_setting(cat_name)
-        is_aux = "辅助" in cat_name
-        is_emo = "表情" in cat_name
-
-        if is_emo: self.action_categories[cat_name] = []
-        elif is_aux: self.action_categories[cat_name] = {}
-        else: self.action_categories[cat_name] = {}
-        if self.excel_data is None: return
+    def load_excel_file(self, path):
+        # 更改 Excel：回到只用这一个工作簿（第一张表）的旧行为
+        self.load_library([{"path": path, "sheets": None}])
 
-        all_actions_pool = [] 
-        for col_idx in col_indices:
-            if col_idx >= self.excel_data.shape[1]: continue
-            col_data = self.excel_data.iloc[:, col_idx]
-            trans_data = None
-            if col_idx + 1 < self.excel_data.shape[1]: trans_data = self.excel_data.iloc[:, col_idx + 1]
-            if len(col_data) > 0: sub_cat = str(col_data.iloc[0]).strip()
-            else: continue
-            for i in range(1, len(col_data)):
-                act_val = col_data.iloc[i]
-                if pd.notna(act_val):
-                    act = str(act_val).strip()
-                    if act:
-                        all_actions_pool.append((act, sub_cat))
-                        if trans_data is not None and i < len(trans_data):
-                            t_val = trans_data.iloc[i]
-                            if pd.notna(t_val):
-                                t_str = str(t_val).strip()
-                                if t_str and t_str.lower() != 'nan':
-                                    self.translation_map[act] = t_str
-        if not all_actions_pool: return
-
-        if is_emo: 
-            self.action_categories[cat_name] = [x[0] for x in all_actions_pool]
-        elif is_aux: 
-            for act, sub in all_actions_pool:
-                if sub not in self.action_categories[cat_name]:
-                    self.action_categories[cat_name][sub] = {}
-                self.action_categories[cat_name][sub][act] = 1
-        else:
-            final_selection = []
-            shuffled_pool = all_actions_pool.copy()
-            random.shuffle(shuffled_pool)
-            unique_actions = {} 
-            for a, s in shuffled_pool:
-                if a not in unique_actions: unique_actions[a] = s
-            unique_keys = list(unique_actions.keys())
-            count_to_take = min(target_c_count, len(unique_keys))
-            selected_keys = unique_keys[:count_to_take]
+    def load_library(self, sources=None):
+        if sources is None: sources = self.library_sources
+        try:
+            with PERF.span("load_library"):
+                self.action_library.load(sources)
+                if self.action_library.is_empty():
+                    raise ValueError("\n".join(self.action_library.errors.values()) or "没有可用的工作表")
+                self.action_library.retain(sources)
+                self.library_sources = sources
+                self.library = self.action_library
+                self.current_excel_path = self.library_sources[0]["path"]
+                self.save_config()
+                self.build_dedup_index()
+                self.translation_map = {}
+                used = set()
+                for cat in self.col_mapping.keys():
+                    _, min_c = self.parse_config_setting(cat)
+                    self.process_category_data(cat, target_c_count=min_c, used_clusters=used)
+                self.update_ui_display()
+            label = os.path.basename(self.current_excel_path)
+            if len(self.library_sources) > 1: label += f" +{len(self.library_sources) - 1}"
+            self.file_label.setText(label)
+            self.file_label.setToolTip("\n".join(name for name, _ in self.library.sheets))
+            if self.action_library.errors:
+                msg = "\n".join(f"{os.path.basename(p)}: {e}" for p, e in self.action_library.errors.items())
+                QMessageBox.warning(self, "部分来源读取失败", msg)
+        except Exception as e:
+            QMessageBox.critical(self, "错误", f"无法读取文件: {str(e)}")
+            # 恢复到上一次成功加载的来源（都在缓存里，不会重新解析）
+            if self.library is not None and sources is not self.library_sources:
+                self.action_library.load(self.library_sources)
 
-            for act in selected_keys:
-                sub = unique_actions[act]
-                repeat = random.randint(REPEAT_MIN, REPEAT_MAX)
-                final_selection.append({'action': act, 'count': repeat, 'sub': sub})
-            for _, sub in all_actions_pool:
-                if sub not in self.action_categories[cat_name]:
-                    self.action_categories[cat_name][sub] = []
-            for item in final_selection:
-                sub = item['sub']
-                self.action_categories[cat_name][sub].append({item['action']: item['count']})
+    @timed()
+    def process_category_data(self, cat_name, target_c_count=DEFAULT_MIN_C, used_clusters=None):
+        col_indices, _ = self.parse_config_setting(cat_name)
+        dedup = self.dedup_index if self.cross_category_unique else None
+        if dedup is not None and used_clusters is None:
+            used_clusters = self.used_clusters(exclude_cat=cat_name)
+        self.action_categories[cat_name] = draw_category(
+            self.library, cat_name, col_indices, target_c_count, self.translation_map,
+            dedup_index=dedup, used_clusters=used_clusters)
+
+    def main_categories(self):
+        return [k for k in self.col_mapping.keys() if "辅助" not in k and "表情" not in k]
+
+    @timed()
+    def build_dedup_index(self):
+        entries = []
+        for cat in self.main_categories():
+            col_indices, _ = self.parse_config_setting(cat)
+            for col_idx in col_indices:
+                for sub_cat, act, _ in self.library.iter_column(col_idx):
+                    entries.append((act, f"{cat} / {sub_cat}"))
+        self.dedup_index = ActionDedupIndex().build(entries)
+        groups = len(self.dedup_index.groups())
+        self.btn_dup.setText(f"查重 ({groups})" if groups else "查重")
+
+    def used_clusters(self, exclude_cat=None):
+        """其它分类当前已抽中的动作所在的簇"""
+        used = set()
+        if self.dedup_index is None: return used
+        for cat, data in self.action_categories.items():
+            if cat == exclude_cat or not isinstance(data, dict): continue
+            for acts_list in data.values():
+                if not isinstance(acts_list, list): continue
+                for group in acts_list:
+                    for act in group: used.add(self.dedup_index.cluster_id(act))
+        return used
+
+    def toggle_cross_category_unique(self, state):
+        self.cross_category_unique = (state == Qt.Checked)
+        self.config_data["cross_category_unique"] = self.cross_category_unique
+        self.save_config()
+
+    def open_duplicate_report(self):
+        if self.dedup_index is None:
+            QMessageBox.information(self, "提示", "请先加载动作库")
+            return
+        groups = self.dedup_index.groups()
+        if not groups:
+            QMessageBox.information(self, "查重", "没有发现重复或近似重复的动作")
+            return
+        lines = []
+        for kind, sim, locs in groups:
+            title = f"【{kind}】" + (f" 相似度 ≥ {sim:.2f}" if kind == "近似重复" else "")
+            lines.append(title)
+            for act, loc in locs:
+                trans = self.translation_map.get(act, "")
+                lines.append(f"    {loc}: {act}" + (f"  ({trans})" if trans else ""))
+            lines.append("")
+        dialog = QDialog(self)
+        dialog.setWindowTitle(f"查重结果 - {len(groups)} 组")
+        dialog.resize(900, 600)
+        layout = QVBoxLayout(dialog)
+        text = QTextEdit(); text.setReadOnly(True); text.setPlainText("\n".join(lines))
+        layout.addWidget(text)
+        btn = QPushButton("关闭"); btn.clicked.connect(dialog.accept); layout.addWidget(btn)
+        dialog.exec_()
 
     def refresh_category_widgets(self):
         for i in reversed(range(self.cats_layout.count())): 
@@ -705,6 +1513,7 @@ class MainWindow(QMainWindow):
 
     def sync_category_ui_order(self): self.refresh_category_widgets()
 
+    @timed()
     def update_ui_display(self):
         total_prompts_count = 0 
         for cat, widgets in self.category_widgets.items():
@@ -751,72 +1560,42 @@ class MainWindow(QMainWindow):
         self.status_label.setText(f"当前总计: {total_prompts_count} 张")
 
     def clear_single_category(self, cat):
-        if "表情" in cat: self.action_categories[cat] = []
-        elif "辅助" in cat: self.action_categories[cat] = {}
-        else: self.action_categories[cat] = {} 
+        self.action_categories[cat] = empty_category_data(cat)
         self.update_ui_display()
 
     def reset_single_category(self, cat):
-        if self.excel_data is not None:
+        if self.library is not None:
             target_c = DEFAULT_MIN_C
             if cat in self.category_widgets: target_c = self.category_widgets[cat]['spin_c'].value()
             self.process_category_data(cat, target_c_count=target_c)
             self.update_ui_display()
 
     def reset_all_actions(self):
-        if self.excel_data is not None:
+        if self.library is not None:
             self.combined_plan = []
+            self.cost_model.rebuild(self.combined_plan)
             self.refresh_prompt_list()
+            used = set()
             for cat_name in self.action_categories.keys():
                 target_c = DEFAULT_MIN_C
                 if cat_name in self.category_widgets: target_c = self.category_widgets[cat_name]['spin_c'].value()
-                self.process_category_data(cat_name, target_c_count=target_c)
+                self.process_category_data(cat_name, target_c_count=target_c, used_clusters=used)
             self.update_ui_display()
         else: QMessageBox.warning(self, "警告", "请先点击'更改 Excel'加载数据")
 
     def generate_plan(self):
-        if self.excel_data is None:
+        if self.library is None:
             QMessageBox.warning(self, "警告", "请先加载Excel文件")
             return
         order = [self.cat_list.item(i).text() for i in range(self.cat_list.count())]
-        raw_plan = []
-        for cat_name in order:
-            if cat_name not in self.category_widgets: continue
-            widget = self.category_widgets[cat_name]['text']
-            if not widget: continue
-            text_content = widget.toPlainText()
-            lines = text_content.split('\n')
-            for line in lines:
-                line = line.strip()
-                if not line: continue
-                if ':' in line: parts = line.split(':', 1); content_part = parts[1].strip()
-                else: content_part = line 
-                if '|' in content_part: actions = content_part.split('|')
-                else: actions = content_part.split(',')
-                for item in actions:
-                    item = item.strip()
-                    if not item: continue
-                    action_name = item
-                    count = 1
-                    if '*' in item:
-                        a_parts = item.rsplit('*', 1) 
-                        if len(a_parts) == 2 and a_parts[1].isdigit():
-                            action_name = a_parts[0].strip(); count = int(a_parts[1])
-                    original_code = action_name
-                    if not self.use_original_text: 
-                         for code, trans in self.translation_map.items():
-                             if trans == action_name: original_code = code; break
-                    raw_plan.extend([original_code] * count)
-        self.combined_plan = []
-        for action in raw_plan:
-            self.combined_plan.append({
-                "original_action": action, 
-                "translation": self.translation_map.get(action, "无标签"), 
-                "checked": False,
-                "image_size": None 
-            })
+        order = [c for c in order if c in self.category_widgets]
+        with PERF.span("generate_plan"):
+            # 直接展开抽取结果：多个来源合并后常有译文相同的动作，按预览文本反查译文会认错代码
+            self.combined_plan = build_plan(self.action_categories, order, self.translation_map)
+            self.cost_model.rebuild(self.combined_plan)
         self.refresh_prompt_list()
 
+    @timed()
     def refresh_prompt_list(self):
         self.prompt_table.setRowCount(0) 
         self.prompt_table.setRowCount(len(self.combined_plan))
@@ -855,6 +1634,7 @@ class MainWindow(QMainWindow):
         header.setSectionResizeMode(4, QHeaderView.Stretch)
         self.prompt_table.resizeRowsToContents()
         self.count_label.setText(f"Prompt数: {len(self.combined_plan)}")
+        self.update_cost_display()
 
     def on_checkbox_toggled(self, checked, index):
         if 0 <= index < len(self.combined_plan): self.combined_plan[index]['checked'] = checked
@@ -872,37 +1652,21 @@ class MainWindow(QMainWindow):
                 if cb: cb.blockSignals(True); cb.setChecked(new_state); cb.blockSignals(False)
 
     def move_prompt(self, direction):
-        indices = [i for i, x in enumerate(self.combined_plan) if x["checked"]]
-        if not indices: return
-        moved = False
-        if direction == -1: 
-            for i in sorted(indices):
-                if i > 0 and not self.combined_plan[i-1]["checked"]:
-                    self.combined_plan[i], self.combined_plan[i-1] = self.combined_plan[i-1], self.combined_plan[i]; moved = True
-        else: 
-            for i in sorted(indices, reverse=True):
-                if i < len(self.combined_plan) - 1 and not self.combined_plan[i+1]["checked"]:
-                    self.combined_plan[i], self.combined_plan[i+1] = self.combined_plan[i+1], self.combined_plan[i]; moved = True
-        if moved: self.refresh_prompt_list()
+        if plan_move_checked(self.combined_plan, direction): self.refresh_prompt_list()
 
     def batch_check(self, state):
         for i in range(len(self.combined_plan)): self.combined_plan[i]['checked'] = state
         self.refresh_prompt_list()
 
     def delete_selected_prompt(self):
+        self.cost_model.remove(x for x in self.combined_plan if x['checked'])
         self.combined_plan = [x for x in self.combined_plan if not x['checked']]
         self.refresh_prompt_list()
 
     def copy_selected_prompt(self):
-        indices = [i for i, x in enumerate(self.combined_plan) if x["checked"]]
-        if not indices: return
-        offset = 0
-        for i in sorted(indices):
-            current_idx = i + offset
-            new_item = self.combined_plan[current_idx].copy()
-            new_item['checked'] = True
-            self.combined_plan.insert(current_idx + 1, new_item)
-            offset += 1
+        if not any(x["checked"] for x in self.combined_plan): return
+        self.cost_model.add(x for x in self.combined_plan if x["checked"])
+        self.combined_plan = plan_copy_checked(self.combined_plan)
         self.refresh_prompt_list()
 
     def add_extra_prompt(self):
@@ -910,13 +1674,11 @@ class MainWindow(QMainWindow):
         if not indices: QMessageBox.information(self, "提示", "请先勾选需要添加tag的行"); return
         text, ok = QInputDialog.getText(self, "添加tag", "请输入要添加的 tag (例如: masterpiece)：")
         if ok and text:
-            for i in indices:
-                orig = self.combined_plan[i]["original_action"]
-                self.combined_plan[i]["original_action"] = f"{text}, {orig}" if not orig.startswith(",") else f"{text}{orig}"
+            plan_add_tag(self.combined_plan, indices, text)
             self.refresh_prompt_list()
 
     def open_manual_selection_window(self, cat_name):
-        if self.excel_data is None: return
+        if self.library is None: return
         
         options = self.get_all_options_for_category(cat_name)
         if not options: QMessageBox.information(self, "提示", "该分类下无可用选项"); return
@@ -1068,22 +1830,8 @@ class MainWindow(QMainWindow):
         col_indices, _ = self.parse_config_setting(cat_name)
         options = [] 
         for col_idx in col_indices:
-            if col_idx >= self.excel_data.shape[1]: continue
-            col_data = self.excel_data.iloc[:, col_idx]
-            trans_data = None
-            if col_idx + 1 < self.excel_data.shape[1]: trans_data = self.excel_data.iloc[:, col_idx + 1]
-            if len(col_data) > 0: sub_cat = str(col_data.iloc[0]).strip()
-            else: continue
-            for i in range(1, len(col_data)):
-                act_val = col_data.iloc[i]
-                if pd.notna(act_val):
-                    act = str(act_val).strip()
-                    if act:
-                        t_str = ""
-                        if trans_data is not None and i < len(trans_data):
-                            t_val = trans_data.iloc[i]
-                            if pd.notna(t_val): t_str = str(t_val).strip()
-                        options.append({"sub": sub_cat, "act": act, "trans": t_str})
+            for sub_cat, act, t_str in self.library.iter_column(col_idx):
+                options.append({"sub": sub_cat, "act": act, "trans": t_str})
         return options
 
     def open_add_action_window(self):
@@ -1188,49 +1936,8 @@ class MainWindow(QMainWindow):
                 
             while True:
                 try:
-                    final = [x["original_action"] for x in self.combined_plan]
-                    seeds = [str(random.randint(10000000000000, 99999999999999)) for _ in final]
-                    
-                    # [修改] 提取图像大小逻辑（保持字符串格式不拆分）
-                    sizes = []
-                    for x in self.combined_plan:
-                        raw_size = x.get('image_size')
-                        if raw_size:
-                            # 提取 "SDXL_1024x960" 后面的 "1024x960"
-                            parts = raw_size.split('_', 1)
-                            if len(parts) > 1:
-                                sizes.append(parts[1])
-                            else:
-                                sizes.append(raw_size)
-                        else:
-                            sizes.append(DEFAULT_RESOLUTION)
-
-                    # [修改] DataFrame 列顺序重排
-                    # 1: 完成情况, 2: 序号, 3: 动作Prompt, 4: 种子, 5: 图像大小
-                    df = pd.DataFrame({
-                        "完成情况": [""] * len(final),
-                        "序号": range(1, len(final)+1),
-                        "动作Prompt": final,
-                        "种子": seeds,
-                        "图像大小": sizes
-                    })
-                    
-                    with pd.ExcelWriter(path, engine='openpyxl') as writer:
-                        df.to_excel(writer, index=False, sheet_name='Sheet1')
-                        ws = writer.sheets['Sheet1']
-                        
-                        # 调整列宽
-                        ws.column_dimensions['A'].width = 15 # 完成情况
-                        ws.column_dimensions['B'].width = 8  # 序号
-                        ws.column_dimensions['C'].width = 50 # Prompt
-                        ws.column_dimensions['D'].width = 25 # 种子
-                        ws.column_dimensions['E'].width = 15 # 图像大小
-                        
-                        # 种子列（第4列）设置文本格式
-                        for row in range(2, len(final) + 2):
-                            cell = ws.cell(row=row, column=4)
-                            cell.number_format = '@' 
-                            
+                    with PERF.span("export_excel"):
+                        write_plan_xlsx(self.combined_plan, path)
                     QMessageBox.information(self, "成功", "导出完成")
                     break 
 
@@ -1247,8 +1954,11 @@ class MainWindow(QMainWindow):
                     break
 
 if __name__ == "__main__":
+    # 打包成 exe 后进程池的子进程会重新执行入口，必须先交给 freeze_support 处理，否则每个子进程都会再开一个窗口
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     set_light_theme(app)
     window = MainWindow(app)
     window.show()
+    QTimer.singleShot(0, window.load_saved_library)
     sys.exit(app.exec_())
\ No newline at end of file
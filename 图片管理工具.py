@@ -6,10 +6,21 @@ os.environ["QT_ENABLE_HIGHDPI_SCALING"] = "0"
 os.environ["QT_SCALE_FACTOR"] = "1"
 
 import re
+import io
 import json
 import math
+import zlib
+import time
+import sqlite3
+import bisect
+import shutil
+import threading
 import subprocess
-from PIL import Image, ImageFile
+import multiprocessing
+from abc import ABC, abstractmethod
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from PIL import Image, ImageFile, ImageFilter
 
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
@@ -17,17 +28,16 @@ from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
                              QHBoxLayout, QPushButton, QLabel, QFileDialog, QComboBox, 
                              QMessageBox, QProgressBar, QGraphicsView, 
                              QGraphicsScene, QGraphicsItem, QGraphicsObject,
-                             QGraphicsDropShadowEffect, QDialog, QFrame)
+                             QGraphicsDropShadowEffect, QDialog, QFrame,
+                             QProgressDialog, QDialogButtonBox)
 from PyQt6.QtCore import (Qt, QThread, pyqtSignal, QSettings, QRectF, 
-                          QPointF, QTimer)
+                          QPointF, QTimer, QFileSystemWatcher, QEvent)
 from PyQt6.QtGui import (QPixmap, QPainter, QPen, QColor, 
-                         QTransform, QImage, QPainterPath)
-
-from reportlab.pdfgen import canvas
-from reportlab.lib.utils import ImageReader as PDFImageReader
+                         QImage, QPainterPath)
 
 # 尝试导入 win32com 用于控制 Photoshop
 try:
+    import pythoncom
     import win32com.client
     HAS_WIN32 = True
 except ImportError:
@@ -74,59 +84,470 @@ QGraphicsView { border: none; background-color: #f0f0f0; }
 """
 
 # =========================================================
-# 1. 加载线程
+# 1. 缩略图缓存与加载线程
 # =========================================================
+THUMB_CACHE_FILE = "thumb_cache.sqlite"
+THUMB_CACHE_DEFAULT_MB = 512
+THUMB_MEMORY_DEFAULT_MB = 256  # 场景里同时驻留的缩略图像素上限
+THUMB_LEVELS = (128, 256, 512)  # 缓存里的缩略图金字塔（宽度）
+
+def thumb_level(display_width):
+    """显示宽度对应的金字塔级别：不小于显示宽度的最小一级，保证只缩不放"""
+    for level in THUMB_LEVELS:
+        if level >= display_width: return level
+    return THUMB_LEVELS[-1]
+
+class ThumbnailCache:
+    """持久化的缩略图缓存（SQLite 单文件）。
+
+    以 (路径, 目标宽度) 为主键，同时记录原图的文件大小与 mtime，
+    原图改动后旧条目视为失效并在下次写入时被覆盖。缩略图按原样编码
+    （有透明通道存 PNG，否则存 JPEG），超出容量预算时按最近访问时间淘汰。
+    连接在线程间共享，所有数据库操作都在锁内完成；解码/缩放不占锁。
+    """
+    def __init__(self, db_path, budget_bytes=THUMB_CACHE_DEFAULT_MB * 1024 * 1024):
+        self.db_path = db_path
+        self.budget_bytes = budget_bytes
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS thumbs (
+            path TEXT NOT NULL, width INTEGER NOT NULL,
+            src_size INTEGER NOT NULL, src_mtime INTEGER NOT NULL,
+            data BLOB NOT NULL, nbytes INTEGER NOT NULL, last_access REAL NOT NULL,
+            PRIMARY KEY (path, width))""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_thumbs_access ON thumbs(last_access)")
+        # 只读文件头得到的元数据，同样以文件大小 + mtime 判断是否过期
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS meta (
+            path TEXT PRIMARY KEY, src_size INTEGER NOT NULL, src_mtime INTEGER NOT NULL,
+            width INTEGER NOT NULL, height INTEGER NOT NULL, mode TEXT NOT NULL, format TEXT)""")
+        # 感知哈希（64 位 dHash，存十六进制文本，避开 SQLite 有符号整数）
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS phash (
+            path TEXT PRIMARY KEY, src_size INTEGER NOT NULL, src_mtime INTEGER NOT NULL, dhash TEXT NOT NULL)""")
+        self.conn.commit()
+        self._touched = []
+
+    @staticmethod
+    def encode(pil_img):
+        buf = io.BytesIO()
+        if pil_img.mode == "RGBA" and pil_img.getchannel("A").getextrema() == (255, 255):
+            pil_img = pil_img.convert("RGB")
+        if pil_img.mode in ("RGBA", "LA", "P"): pil_img.save(buf, "PNG", compress_level=1)
+        else: pil_img.save(buf, "JPEG", quality=90)
+        return buf.getvalue()
+
+    def get(self, path, st, width):
+        """命中时返回编码后的缩略图字节；st 为原图的 os.stat 结果"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT data, src_size, src_mtime FROM thumbs WHERE path=? AND width=?", (path, width)).fetchone()
+            if row is None or row[1] != st.st_size or row[2] != st.st_mtime_ns: return None
+            self._touched.append((time.time(), path, width))
+            return row[0]
+
+    def put(self, path, st, width, data):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO thumbs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (path, width, st.st_size, st.st_mtime_ns, sqlite3.Binary(data), len(data), time.time()))
+
+    def get_meta(self, path, st):
+        """命中时返回 (宽, 高, mode, format)"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT width, height, mode, format, src_size, src_mtime FROM meta WHERE path=?", (path,)).fetchone()
+        if row is None or row[4] != st.st_size or row[5] != st.st_mtime_ns: return None
+        return row[:4]
+
+    def put_meta(self, entries):
+        """entries: [(路径, os.stat 结果, (宽, 高, mode, format))]"""
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                  [(p, st.st_size, st.st_mtime_ns) + tuple(m) for p, st, m in entries])
+            self.conn.commit()
+
+    def get_hash(self, path, st):
+        with self.lock:
+            row = self.conn.execute("SELECT dhash, src_size, src_mtime FROM phash WHERE path=?", (path,)).fetchone()
+        if row is None or row[1] != st.st_size or row[2] != st.st_mtime_ns: return None
+        return int(row[0], 16)
+
+    def put_hashes(self, entries):
+        """entries: [(路径, os.stat 结果, dHash)]"""
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO phash VALUES (?, ?, ?, ?)",
+                                  [(p, st.st_size, st.st_mtime_ns, f"{h:016x}") for p, st, h in entries])
+            self.conn.commit()
+
+    def commit(self):
+        """批量写回访问时间并提交，然后按预算淘汰"""
+        with self.lock:
+            if self._touched:
+                self.conn.executemany("UPDATE thumbs SET last_access=? WHERE path=? AND width=?", self._touched)
+                self._touched = []
+            self.conn.commit()
+        self.evict()
+
+    def total_bytes(self):
+        with self.lock:
+            return self.conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM thumbs").fetchone()[0]
+
+    def evict(self):
+        """超出预算时删除最久未访问的条目，直到降到预算的 90%"""
+        total = self.total_bytes()
+        if total <= self.budget_bytes: return
+        target = int(self.budget_bytes * 0.9)
+        with self.lock:
+            doomed = []
+            for path, width, nbytes in self.conn.execute("SELECT path, width, nbytes FROM thumbs ORDER BY last_access"):
+                if total <= target: break
+                doomed.append((path, width))
+                total -= nbytes
+            self.conn.executemany("DELETE FROM thumbs WHERE path=? AND width=?", doomed)
+            self.conn.commit()
+
+IMAGE_EXTS = ('.jpg', '.png', '.jpeg', '.bmp', '.gif', '.webp')
+_NATURAL_SPLIT = re.compile(r'(\d+)')
+
+def natural_key(name):
+    """自然排序键：img_2 排在 img_10 前面"""
+    return [int(x) if x.isdigit() else x.lower() for x in _NATURAL_SPLIT.split(name)]
+
+def scan_image_folder(folder):
+    """用 os.scandir 列出文件夹里的图片（Windows 上免去逐个 stat），按自然顺序返回完整路径"""
+    with os.scandir(folder) as it:
+        entries = [(natural_key(e.name), e.path) for e in it
+                   if e.name.lower().endswith(IMAGE_EXTS) and e.is_file()]
+    entries.sort()
+    return [p for _, p in entries]
+
+def read_image_header(path):
+    """Image.open 只解析文件头，不解码像素；读不出来返回 None"""
+    try:
+        with Image.open(path) as img: return (img.width, img.height, img.mode, img.format)
+    except Exception:
+        return None
+
+def build_meta_index(paths, cache=None, workers=None):
+    """元数据索引 {路径: (宽, 高, mode, format)}。缓存里没过期的直接用，
+    其余并行读文件头并写回缓存；读不出文件头的图不在结果里。"""
+    index, todo = {}, []
+    for p in paths:
+        try: st = os.stat(p)
+        except OSError: continue
+        meta = cache.get_meta(p, st) if cache is not None else None
+        if meta is not None: index[p] = meta
+        else: todo.append((p, st))
+    if todo:
+        with ThreadPoolExecutor(max_workers=workers or min(16, os.cpu_count() or 4)) as pool:
+            headers = list(pool.map(read_image_header, [p for p, _ in todo]))
+        fresh = [(p, st, meta) for (p, st), meta in zip(todo, headers) if meta is not None]
+        index.update((p, meta) for p, _, meta in fresh)
+        if cache is not None and fresh:
+            try: cache.put_meta(fresh)
+            except Exception as e: print(f"元数据缓存写入失败: {e}")
+    return index
+
+def thumbnail_mode(pil_img):
+    """缩略图只需要两种模式：带透明信息的转 RGBA，其余一律 RGB（不为不透明图多算一个通道）"""
+    if pil_img.mode in ("RGBA", "LA", "PA") or "transparency" in pil_img.info:
+        return pil_img if pil_img.mode == "RGBA" else pil_img.convert("RGBA")
+    return pil_img if pil_img.mode == "RGB" else pil_img.convert("RGB")
+
+def decode_thumbnail(path, target_width):
+    """按目标宽度解码缩略图，返回 (PIL 图像, 是否经过缩小)。
+
+    JPEG 先用 draft() 让解码器直接在 DCT 域按 1/2、1/4、1/8 缩小解码，
+    其余格式靠 reducing_gap 先做整数倍 reduce() 再用 LANCZOS 收尾，
+    大图缩到很小时不必对全尺寸像素做 LANCZOS 卷积。"""
+    pil_img = Image.open(path)
+    w, h = pil_img.size
+    if w <= target_width * 1.5:
+        pil_img = thumbnail_mode(pil_img)
+        pil_img.load()  # 在工作线程里解码完，别把懒加载的图交给界面线程
+        return pil_img, False
+    th = max(1, int(h * target_width / float(w)))
+    if pil_img.format == "JPEG":
+        pil_img.draft(pil_img.mode, (target_width, th))
+    pil_img = thumbnail_mode(pil_img)
+    return pil_img.resize((target_width, th), Image.Resampling.LANCZOS, reducing_gap=2.0), True
+
+class OwnedQImage(QImage):
+    """直接引用像素缓冲的 QImage（同 PIL.ImageQt 的做法）：QImage 不拷贝外部数据，
+    这里把 bytes 挂在对象上保证缓冲与图像同生命周期，省掉一次 deep copy。"""
+    def __init__(self, data, width, height, bytes_per_line, fmt):
+        super().__init__(data, width, height, bytes_per_line, fmt)
+        self._data = data
+
+def pil_to_qimage(pil_img):
+    """在工作线程里把 PIL 图转成可直接上传的 QImage，界面线程只剩 QPixmap.fromImage。
+    用 Qt 原生的 32 位格式：不透明图 RGB32，透明图预乘 ARGB32（绘制时无需再转换）。"""
+    w, h = pil_img.size
+    if pil_img.mode == "RGB":
+        return OwnedQImage(pil_img.tobytes("raw", "BGRX"), w, h, w * 4, QImage.Format.Format_RGB32)
+    if pil_img.mode != "RGBA": pil_img = pil_img.convert("RGBA")
+    try:
+        data = pil_img.tobytes("raw", "BGRa")
+        fmt = QImage.Format.Format_ARGB32_Premultiplied
+    except ValueError:  # 老版本 Pillow 没有预乘打包器
+        data = pil_img.tobytes("raw", "BGRA")
+        fmt = QImage.Format.Format_ARGB32
+    return OwnedQImage(data, w, h, w * 4, fmt)
+
+def load_thumbnail_image(path, target_width, cache=None):
+    """取一张缩略图的 QImage：先查缓存，未命中再解码原图并写回缓存（在工作线程调用）。
+    解码出某一级时顺手把更小的各级也缩出来存上，切到小档位时直接命中。"""
+    st = os.stat(path)
+    if cache is not None:
+        data = cache.get(path, st, target_width)
+        if data is not None:
+            qimage = QImage.fromData(data)
+            if not qimage.isNull():
+                if qimage.hasAlphaChannel():
+                    qimage = qimage.convertToFormat(QImage.Format.Format_ARGB32_Premultiplied)
+                return qimage
+    pil_img, reduced = decode_thumbnail(path, target_width)
+    if reduced and cache is not None:
+        cache.put(path, st, target_width, ThumbnailCache.encode(pil_img))
+        for level in THUMB_LEVELS:
+            if level >= target_width: break
+            small = pil_img.resize((level, max(1, int(pil_img.height * level / pil_img.width))),
+                                   Image.Resampling.LANCZOS, reducing_gap=2.0)
+            cache.put(path, st, level, ThumbnailCache.encode(small))
+    return pil_to_qimage(pil_img)
+
 class ImageLoaderThread(QThread):
+    """先读元数据索引一次性发出（视图据此放好占位图元、排好版），
+    再把解码/缩放分发到线程池（Pillow 解码与缩放时会释放 GIL），
+    同时最多有 workers*2 张图在途；结果按提交顺序依次发出，默认即 image_paths 的顺序。"""
     progress_signal = pyqtSignal(int, int)
+    meta_signal = pyqtSignal(object)  # [(路径, (宽, 高, mode, format))]，按 image_paths 顺序
     item_loaded_signal = pyqtSignal(object, str) 
 
-    def __init__(self, image_paths, target_width):
+    def __init__(self, image_paths, target_width, cache=None, workers=None):
         super().__init__()
         self.image_paths = image_paths
         self.target_width = target_width
+        self.cache = cache
+        self.workers = workers or min(16, os.cpu_count() or 4)
         self.is_running = True
+        self.todo = deque(image_paths)  # 还没提交解码的路径，prioritize 可以把视口里的挪到前面
+        self.todo_lock = threading.Lock()
+
+    def load_one(self, path):
+        return load_thumbnail_image(path, self.target_width, self.cache)
+
+    def prioritize(self, paths):
+        """视口里还没轮到的图提前解码（视图不另外回取这些图，免得同一张解两遍）"""
+        wanted = set(paths)
+        with self.todo_lock:
+            front = [p for p in self.todo if p in wanted]
+            if front: self.todo = deque(front + [p for p in self.todo if p not in wanted])
 
     def run(self):
+        index = build_meta_index(self.image_paths, self.cache, self.workers)
+        self.meta_signal.emit([(p, index[p]) for p in self.image_paths if p in index])
         total = len(self.image_paths)
-        for i, path in enumerate(self.image_paths):
-            if not self.is_running: break
+        finished = 0
+        in_flight = deque()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            def submit_next():
+                with self.todo_lock:
+                    if not self.todo: return
+                    path = self.todo.popleft()
+                in_flight.append((path, pool.submit(self.load_one, path)))
+            for _ in range(self.workers * 2): submit_next()
+            while in_flight and self.is_running:
+                path, future = in_flight.popleft()
+                try:
+                    self.item_loaded_signal.emit(future.result(), path)
+                except Exception:
+                    pass 
+                finished += 1
+                self.progress_signal.emit(finished, total)
+                submit_next()
+            for _, future in in_flight: future.cancel()
+        if self.cache is not None:
+            try: self.cache.commit()
+            except Exception as e: print(f"缩略图缓存写入失败: {e}")
+
+    def stop(self):
+        self.is_running = False
+        self.wait()
+
+FETCH_COMMIT_EVERY = 64  # 回取线程每取这么多张提交一次缓存，队列取空时也提交
+
+class ThumbnailFetchThread(QThread):
+    """常驻的回取线程：视图滚动时把靠近视口、像素已被回收的缩略图重新取回。
+    每次 request 都整体替换待取队列，滚过去的旧请求直接作废。
+    新解出的缩略图和访问时间分批提交到缓存，程序中途退出也不丢这次回取的结果。"""
+    fetched_signal = pyqtSignal(object, str, int)
+
+    def __init__(self, cache=None):
+        super().__init__()
+        self.cache = cache
+        self.queue = deque()
+        self.cond = threading.Condition()
+        self.is_running = True
+
+    def request(self, paths, target_width):
+        with self.cond:
+            self.queue = deque((p, target_width) for p in paths)
+            self.cond.notify()
+        if paths and not self.isRunning(): self.start()
+
+    def run(self):
+        uncommitted = 0
+        while True:
+            with self.cond:
+                while self.is_running and not self.queue: self.cond.wait()
+                if not self.is_running: break
+                path, width = self.queue.popleft()
+                drained = not self.queue
             try:
-                pil_img = Image.open(path)
-                if pil_img.mode != "RGBA":
-                    pil_img = pil_img.convert("RGBA")
-                w, h = pil_img.size
-                if w > self.target_width * 1.5: 
-                    ratio = self.target_width / float(w)
-                    new_h = int(h * ratio)
-                    pil_img = pil_img.resize((self.target_width, new_h), Image.Resampling.LANCZOS)
-                self.item_loaded_signal.emit(pil_img, path)
+                qimage = load_thumbnail_image(path, width, self.cache)
             except Exception:
-                pass 
-            self.progress_signal.emit(i + 1, total)
+                qimage = None  # 让视图把它标成坏图，不再反复回取
+            self.fetched_signal.emit(qimage, path, width)
+            uncommitted += 1
+            if drained or uncommitted >= FETCH_COMMIT_EVERY:
+                self.commit_cache()
+                uncommitted = 0
+        if uncommitted: self.commit_cache()
+
+    def commit_cache(self):
+        if self.cache is None: return
+        try: self.cache.commit()
+        except Exception as e: print(f"缩略图缓存写入失败: {e}")
 
     def stop(self):
-        self.is_running = False
+        with self.cond:
+            self.is_running = False
+            self.cond.notify()
         self.wait()
 
 # =========================================================
 # 2. 图元类
 # =========================================================
+OVERLAY_CACHE_BYTES = 32 * 1024 * 1024  # 选中/悬停叠加层缓存的上限
+
 class ThumbnailItem(QGraphicsObject):
-    def __init__(self, pixmap, path, index):
+    # 选中/悬停叠加层只跟尺寸有关，同尺寸的图元共用一张：(宽, 高, dpr, 是否选中) -> pixmap
+    overlays = OrderedDict()
+    overlay_bytes = 0
+
+    def __init__(self, pixmap, path, index, level=0, display_width=100, aspect=None):
         super().__init__()
         self.internal_pixmap = pixmap 
+        self.source_image = None
+        self.pixmap_level = level  # 当前 pixmap 来自金字塔的哪一级
+        has_pixmap = pixmap is not None and not pixmap.isNull()
+        self.broken = aspect is None and not has_pixmap  # 解码失败的图不再回取
+        # 宽高比取自元数据索引（占位图元）或第一次拿到的缩略图；
+        # 像素被回收或换级后图元仍按显示尺寸参与布局和选择
+        if aspect is None: aspect = pixmap.height() / pixmap.width() if has_pixmap else 1.0
+        self.aspect = aspect
+        self.display_size = (display_width, display_width * self.aspect)
         self.path = path
         self.index_id = index 
         self.setAcceptHoverEvents(True)
         self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIsSelectable)
         self.is_hovered = False
         self.path_clip = None
+        self.path_border = None
         self.rect_cache = QRectF()
+        # 按显示尺寸预渲染好的圆角底图，平时 paint 只贴这一张图，选中/悬停叠加层另外贴在上面；
+        # 尺寸、像素或屏幕缩放变了才重画。render_dpr 由视图按屏幕缩放设置，用于记账
+        self.rendered = None
+        self.rendered_key = None
+        self.render_dpr = 1.0
 
     def boundingRect(self):
-        if self.internal_pixmap and not self.internal_pixmap.isNull():
-            return QRectF(0, 0, self.internal_pixmap.width(), self.internal_pixmap.height())
-        return QRectF(0, 0, 100, 100)
+        return QRectF(0, 0, self.display_size[0], self.display_size[1])
+
+    def set_display_width(self, width):
+        self.prepareGeometryChange()
+        self.display_size = (width, width * self.aspect)
+
+    def has_pixmap(self):
+        return self.internal_pixmap is not None and not self.internal_pixmap.isNull()
+
+    def pixmap_bytes(self):
+        """源 pixmap 加上显示尺寸的底图（还没画出来也按将要占用的算）"""
+        if not self.has_pixmap(): return 0
+        w, h = self.display_size
+        return (self.internal_pixmap.width() * self.internal_pixmap.height()
+                + round(w * self.render_dpr) * round(h * self.render_dpr)) * 4
+
+    def set_pixmap(self, pixmap, image=None, level=0):
+        self.internal_pixmap = pixmap
+        self.source_image = image
+        self.pixmap_level = level
+        self.rendered = self.rendered_key = None
+        self.update()
+
+    def release_pixmap(self):
+        self.internal_pixmap = None
+        self.source_image = None
+        self.rendered = self.rendered_key = None
+        self.update()
+
+    def render(self, dpr):
+        """把缩略图按显示尺寸缩放、切圆角，画成一张底图"""
+        w, h = self.display_size
+        out = QPixmap(max(1, round(w * dpr)), max(1, round(h * dpr)))
+        out.setDevicePixelRatio(dpr)
+        out.fill(Qt.GlobalColor.transparent)
+        p = QPainter(out)
+        p.setRenderHint(QPainter.RenderHint.Antialiasing)
+        p.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+        p.setClipPath(self.path_clip)
+        p.drawPixmap(QRectF(0, 0, w, h), self.internal_pixmap, QRectF(self.internal_pixmap.rect()))
+        p.end()
+        return out
+
+    def overlay_pixmap(self, rect, dpr, selected):
+        """取（没有就画）这个尺寸的选中/悬停叠加层；按最近使用保留，总量不超过 OVERLAY_CACHE_BYTES"""
+        cache = ThumbnailItem.overlays
+        key = (rect.width(), rect.height(), dpr, selected)
+        pm = cache.get(key)
+        if pm is not None:
+            cache.move_to_end(key)
+            return pm
+        pm = QPixmap(max(1, round(rect.width() * dpr)), max(1, round(rect.height() * dpr)))
+        pm.setDevicePixelRatio(dpr)
+        pm.fill(Qt.GlobalColor.transparent)
+        p = QPainter(pm)
+        self.draw_overlay(p, rect, selected)
+        p.end()
+        cache[key] = pm
+        ThumbnailItem.overlay_bytes += pm.width() * pm.height() * 4
+        while ThumbnailItem.overlay_bytes > OVERLAY_CACHE_BYTES and len(cache) > 1:
+            _, old = cache.popitem(last=False)
+            ThumbnailItem.overlay_bytes -= old.width() * old.height() * 4
+        return pm
+
+    def draw_overlay(self, painter, rect, selected):
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        if selected:
+            painter.fillPath(self.path_clip, QColor(0, 122, 204, 60))
+            painter.setPen(QPen(QColor("#007acc"), 4))
+            painter.setBrush(Qt.BrushStyle.NoBrush)
+            painter.drawPath(self.path_border)
+
+            check_size = 24
+            check_x = rect.width() - check_size - 8
+            check_y = rect.height() - check_size - 8
+            painter.setPen(Qt.PenStyle.NoPen)
+            painter.setBrush(QColor("#007acc"))
+            painter.drawEllipse(int(check_x), int(check_y), check_size, check_size)
+
+            painter.setPen(QPen(QColor("white"), 2))
+            painter.drawLine(int(check_x + 6), int(check_y + 12), int(check_x + 10), int(check_y + 16))
+            painter.drawLine(int(check_x + 10), int(check_y + 16), int(check_x + 18), int(check_y + 8))
+        else:
+            painter.fillPath(self.path_clip, QColor(255, 255, 255, 40))
 
     def paint(self, painter, option, widget=None):
         rect = self.boundingRect()
@@ -134,38 +555,25 @@ class ThumbnailItem(QGraphicsObject):
             self.rect_cache = rect
             self.path_clip = QPainterPath()
             self.path_clip.addRoundedRect(rect, 12, 12)
-
-        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
-        painter.save()
-        painter.setClipPath(self.path_clip)
-        if self.internal_pixmap and not self.internal_pixmap.isNull():
-            painter.drawPixmap(0, 0, self.internal_pixmap)
-        painter.restore()
-
-        is_selected = self.isSelected()
-        if is_selected or self.is_hovered:
-            painter.save()
-            if is_selected:
-                painter.fillPath(self.path_clip, QColor(0, 122, 204, 60))
-                pen = QPen(QColor("#007acc"), 4)
-                painter.setPen(pen)
-                painter.setBrush(Qt.BrushStyle.NoBrush)
-                painter.drawPath(self.path_clip)
-                
-                check_size = 24
-                check_x = rect.width() - check_size - 8
-                check_y = rect.height() - check_size - 8
-                painter.setPen(Qt.PenStyle.NoPen)
-                painter.setBrush(QColor("#007acc"))
-                painter.drawEllipse(int(check_x), int(check_y), check_size, check_size)
-                
-                pen_check = QPen(QColor("white"), 2)
-                painter.setPen(pen_check)
-                painter.drawLine(int(check_x + 6), int(check_y + 12), int(check_x + 10), int(check_y + 16))
-                painter.drawLine(int(check_x + 10), int(check_y + 16), int(check_x + 18), int(check_y + 8))
-            elif self.is_hovered:
-                painter.fillPath(self.path_clip, QColor(255, 255, 255, 40))
-            painter.restore()
+            # 边框往里收半个线宽，整条线都落在图元范围内
+            self.path_border = QPainterPath()
+            self.path_border.addRoundedRect(rect.adjusted(2, 2, -2, -2), 10, 10)
+
+        dpr = painter.device().devicePixelRatioF()
+        if not self.has_pixmap():
+            # 像素还在回取中：占位图元不缓存底图，直接画
+            painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+            painter.fillPath(self.path_clip, QColor(128, 128, 128, 50))
+        else:
+            key = (rect.width(), rect.height(), dpr)
+            if self.rendered is None or key != self.rendered_key:
+                self.rendered = self.render(dpr)
+                self.rendered_key = key
+            painter.drawPixmap(QPointF(0, 0), self.rendered)
+        # 选中/悬停效果另外叠一层（同尺寸共用），状态变化不用重画底图
+        selected = self.isSelected()
+        if selected or self.is_hovered:
+            painter.drawPixmap(QPointF(0, 0), self.overlay_pixmap(rect, dpr, selected))
 
     def hoverEnterEvent(self, event):
         self.is_hovered = True
@@ -189,6 +597,7 @@ class DropIndicator(QGraphicsItem):
         return QRectF(-6, -6, 12, self.height + 12)
         
     def paint(self, painter, option, widget=None):
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
         color = QColor("#00FFFF") 
         pen = QPen(color)
         pen.setWidth(6)
@@ -204,6 +613,63 @@ class DropIndicator(QGraphicsItem):
 # =========================================================
 # 4. 流式布局
 # =========================================================
+class PixmapPool:
+    """场景里所有图元像素的统一账本：按字节预算记账，超出时按最近最少使用的顺序
+    回收不在 keep 里（视口附近、正在拖动）的图元。
+    hits 统计图元进入视口附近时已有当前级别像素的次数，misses 统计为缺像素的图元
+    发出回取的次数（各只在进入范围/发出回取时记一次，不随每次刷新重复累计），
+    evictions 统计被回收的次数。"""
+    def __init__(self, budget):
+        self.budget = budget
+        self.entries = OrderedDict()  # item -> 入账字节数；越靠后越是最近用过的
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def put(self, item):
+        """图元换了像素后入账（已在账上的按新大小重记）"""
+        self.bytes -= self.entries.pop(item, 0)
+        size = item.pixmap_bytes()
+        if size:
+            self.entries[item] = size
+            self.bytes += size
+
+    def touch(self, item):
+        """视口附近的图元已有可用像素：挪到最近使用的一端"""
+        if item in self.entries: self.entries.move_to_end(item)
+
+    def hit(self):
+        self.hits += 1
+
+    def miss(self):
+        self.misses += 1
+
+    def discard(self, item):
+        self.bytes -= self.entries.pop(item, 0)
+
+    def over_budget(self):
+        return self.bytes > self.budget
+
+    def evict(self, keep=()):
+        for item in list(self.entries):
+            if self.bytes <= self.budget: break
+            if item in keep: continue
+            self.bytes -= self.entries.pop(item)
+            item.release_pixmap()
+            self.evictions += 1
+
+    def refresh(self):
+        """显示尺寸整体变化后（换档）按各图元现在的大小重新记账，不改变先后顺序"""
+        for item in self.entries: self.entries[item] = item.pixmap_bytes()
+        self.bytes = sum(self.entries.values())
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def stats(self):
+        return {"items": len(self.entries), "bytes": self.bytes, "budget": self.budget,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
 class FlowLayoutView(QGraphicsView):
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -212,9 +678,10 @@ class FlowLayoutView(QGraphicsView):
         self.setAlignment(Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignTop)
         self.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
         self.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAsNeeded)
-        self.setRenderHint(QPainter.RenderHint.Antialiasing)
-        self.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
-        self.setViewportUpdateMode(QGraphicsView.ViewportUpdateMode.FullViewportUpdate)
+        # 缩略图在图元里预渲染成显示尺寸的成品图，视图不再需要平滑缩放；
+        # 悬停、选中只重画变化的图元所在区域
+        self.setViewportUpdateMode(QGraphicsView.ViewportUpdateMode.SmartViewportUpdate)
+        self.setOptimizationFlag(QGraphicsView.OptimizationFlag.DontAdjustForAntialiasing)  # 图元都画在自己的边界内
         self.setDragMode(QGraphicsView.DragMode.RubberBandDrag)
         
         self.items_list = []
@@ -236,82 +703,301 @@ class FlowLayoutView(QGraphicsView):
         self.scroll_timer.timeout.connect(self.auto_scroll)
         self.scroll_step = 0    
 
+        # 加载线程发来的图先进缓冲区，每个定时器节拍批量插入并只排新追加的部分
+        self.pending_items = deque()
+        self.insert_timer = QTimer()
+        self.insert_timer.setInterval(16)
+        self.insert_timer.timeout.connect(self.flush_pending)
+        self.layout_cursor = None  # 上次排版结束时的 (x, y, 当前行最大高度)
+        # 排版结果（不含正在拖动的图元）：拖动时按行二分查找，不再逐个模拟流式布局
+        self.layout_items = []  # 按排版顺序
+        self.item_rects = []    # 与 layout_items 对应的 (x, y, w, h)
+        self.row_tops = []      # 每行的 y
+        self.row_heights = []   # 每行最高图元的高度
+        self.row_first = []     # 每行第一个图元在 layout_items 中的下标
+
+        # 虚拟化：只有视口附近的图元持有 pixmap，其余超出预算时回收，滚回来再从缓存取
+        self.item_by_path = {}
+        self.thumb_width = thumb_level(self.item_width)  # 当前显示档位对应的金字塔级别（回取时用）
+        self.pool = PixmapPool(THUMB_MEMORY_DEFAULT_MB * 1024 * 1024)
+        self.render_dpr = 1.0  # 底图按这个屏幕缩放记账，窗口换到缩放不同的屏幕时整体重记
+        self.fetcher = ThumbnailFetchThread()
+        # 加载线程还没送来的图：视口里缺的交给 loader_hint 让加载线程先解，不另外回取
+        self.loading = set()
+        self.loading_level = None
+        self.loader_hint = None
+        # 命中率统计：上次刷新时在范围内的图元、已发出回取还没送到的 (路径, 级别)
+        self.in_range = set()
+        self.requested = set()
+        self.fetcher.fetched_signal.connect(self.on_thumbnail_fetched)
+        self.visible_timer = QTimer()
+        self.visible_timer.setSingleShot(True)
+        self.visible_timer.setInterval(30)
+        self.visible_timer.timeout.connect(self.update_visible)
+        self.verticalScrollBar().valueChanged.connect(lambda _: self.visible_timer.start())
+
     def resizeEvent(self, event):
         super().resizeEvent(event)
         self.relayout()
-
-    def add_item_from_pil(self, pil_image, path):
+        self.visible_timer.start()
+
+    def event(self, event):
+        if event.type() == QEvent.Type.DevicePixelRatioChange: self.visible_timer.start()
+        return super().event(event)
+
+    def sync_render_dpr(self):
+        dpr = self.viewport().devicePixelRatioF()
+        if dpr == self.render_dpr: return
+        self.render_dpr = dpr
+        for item in self.items_list: item.render_dpr = dpr
+        self.pool.refresh()
+
+    def set_thumb_source(self, cache, level):
+        self.fetcher.cache = cache
+        self.thumb_width = level
+
+    def update_visible(self):
+        """视口上下各多留一屏：范围内的图元记为最近使用、缺像素的去回取；
+        超出预算时由像素池回收范围外最久没用过的。只看范围内那几行（按行二分查找），
+        开销与图元总数无关"""
+        if not self.items_list: return
+        self.sync_render_dpr()
+        top, bottom = self.keep_range()
+        wanted, owed, in_range = [], [], set()
+        keep = set(self.dragging_items)
+        loading = self.loading if self.loading_level == self.thumb_width else ()
+        for item in self.items_in_range(top, bottom):
+            y = item.y()
+            if y + item.display_size[1] < top or y > bottom or item.broken: continue
+            keep.add(item)
+            in_range.add(item)
+            if item.has_pixmap() and item.pixmap_level == self.thumb_width:
+                self.pool.touch(item)
+                if item not in self.in_range: self.pool.hit()
+            elif item.path in loading:
+                owed.append(item.path)
+            else:
+                key = (item.path, self.thumb_width)
+                if key not in self.requested:
+                    self.requested.add(key)
+                    self.pool.miss()
+                wanted.append(item.path)
+        self.in_range = in_range
+        # 离开范围的回取会被撤销，下次进来缺像素时再记一次未命中
+        self.requested = {(item.path, self.thumb_width) for item in in_range} & self.requested
+        if self.pool.over_budget(): self.pool.evict(keep)
+        if owed and self.loader_hint is not None: self.loader_hint(owed)
+        self.fetcher.request(wanted, self.thumb_width)
+
+    def items_in_range(self, top, bottom):
+        """纵向范围 [top, bottom] 可能涉及的图元：排版里落在这几行的，加上正在拖动的"""
+        first = max(0, bisect.bisect_right(self.row_tops, top) - 1)
+        last = bisect.bisect_right(self.row_tops, bottom)
+        start = self.row_first[first] if first < len(self.row_first) else len(self.layout_items)
+        end = self.row_first[last] if last < len(self.row_first) else len(self.layout_items)
+        return self.layout_items[start:end] + self.dragging_items
+
+    def expect_loader(self, paths, level, hint):
+        """登记加载线程将要送来的图；hint(paths) 让它优先解码视口里的"""
+        self.loading.update(paths)
+        self.loading_level = level
+        self.loader_hint = hint
+
+    def loader_finished(self):
+        """加载线程结束后，没送到的图改由回取线程补上（已送到、还在缓冲区里的除外）"""
+        self.loading = {x[1] for x in self.pending_items}
+        self.loader_hint = None
+        self.visible_timer.start()
+
+    def keep_range(self):
+        """视口上下各多留一屏的场景纵向范围：只有这个范围里的图元持有像素"""
+        rect = self.mapToScene(self.viewport().rect()).boundingRect()
+        return rect.top() - rect.height(), rect.bottom() + rect.height()
+
+    def on_thumbnail_fetched(self, qimage, path, width):
+        item = self.item_by_path.get(path)
+        if item is None or width != self.thumb_width: return
+        if qimage is None:
+            item.broken = True
+            return
+        self.fill_item(item, qimage, width)
+        if self.pool.over_budget() and not self.visible_timer.isActive(): self.visible_timer.start()
+
+    def add_placeholders(self, entries, merge=False):
+        """按元数据索引一次建好全部图元并排版（只有尺寸没有像素），缩略图到了再填进去。
+        merge 时（文件夹里新出现的图）按自然顺序插到已有图元之间，和重新打开文件夹的顺序一致"""
+        new_items = []
+        for path, (w, h, _, _) in entries:
+            if path in self.item_by_path or w <= 0: continue
+            item = ThumbnailItem(None, path, len(self.items_list), 0, self.item_width, h / w)
+            self.scene.addItem(item)
+            if merge: self.items_list.insert(self.merge_position(path), item)
+            else: self.items_list.append(item)
+            self.item_by_path[path] = item
+            new_items.append(item)
+        if new_items:
+            if merge: self.relayout()
+            else: self.layout_appended(new_items)
+            self.visible_timer.start()
+
+    def merge_position(self, path):
+        """新图按文件名自然顺序应插入的位置：第一个排在它后面的图元之前"""
+        key = natural_key(os.path.basename(path))
+        for i, item in enumerate(self.items_list):
+            if natural_key(os.path.basename(item.path)) > key: return i
+        return len(self.items_list)
+
+    def fill_item(self, item, qimage, level):
+        if item.has_pixmap() and item.pixmap_level == level: return
+        # raster 后端的 QPixmap 直接共享 QImage 的像素缓冲（不拷贝），
+        # 缓冲归 OwnedQImage 所有，所以图像对象要跟图元活得一样久
+        item.set_pixmap(QPixmap.fromImage(qimage), qimage, level)
+        item.render_dpr = self.render_dpr
+        self.requested.discard((item.path, level))
+        self.pool.put(item)
+
+    def add_item_from_image(self, qimage, path, level=0):
+        self.pending_items.append((qimage, path, level))
+        if not self.insert_timer.isActive(): self.insert_timer.start()
+
+    def flush_pending(self, budget=0.012):
+        """把缓冲区里的图插入场景；单次最多占用 budget 秒，剩下的留给下一个节拍"""
+        t0 = time.perf_counter()
+        new_items = []
+        top, bottom = self.keep_range()
+        while self.pending_items:
+            qimage, path, level = self.pending_items.popleft()
+            self.loading.discard(path)
+            item = self.item_by_path.get(path)
+            if item is not None:
+                # 远离视口的图元不建 pixmap：缩略图已在缓存里，滚过来时 update_visible 再取；
+                # 加载中途换了档位时，旧级别的图不覆盖已有的像素（同 on_thumbnail_fetched）
+                stale = level != self.thumb_width and item.has_pixmap()
+                if not stale and item.y() + item.display_size[1] >= top and item.y() <= bottom:
+                    self.fill_item(item, qimage, level)
+            else:
+                item = self.create_item(qimage, path, level)
+                if item is not None: new_items.append(item)
+            if time.perf_counter() - t0 > budget: break
+        if not self.pending_items: self.insert_timer.stop()
+        if new_items: self.layout_appended(new_items)
+        if self.pool.over_budget() or new_items: self.visible_timer.start()
+
+    def create_item(self, qimage, path, level):
         try:
-            if pil_image.mode != "RGBA":
-                pil_image = pil_image.convert("RGBA")
-            data = pil_image.tobytes("raw", "RGBA")
-            qimage = QImage(data, pil_image.width, pil_image.height, QImage.Format.Format_RGBA8888)
-            pixmap = QPixmap.fromImage(qimage.copy())
+            pixmap = QPixmap.fromImage(qimage)
             
             index = len(self.items_list)
-            item = ThumbnailItem(pixmap, path, index)
-            if not pixmap.isNull():
-                scale = self.item_width / pixmap.width()
-                item.setTransform(QTransform().scale(scale, scale))
+            item = ThumbnailItem(pixmap, path, index, level, self.item_width)
+            item.source_image = qimage  # 同 fill_item：pixmap 共享这块缓冲
+            item.render_dpr = self.render_dpr
+            self.pool.put(item)
             self.scene.addItem(item)
             self.items_list.append(item)
-            self.relayout()
+            self.item_by_path[path] = item
+            return item
         except Exception:
-            pass
+            return None
 
     def clear_items(self):
+        self.pending_items.clear()
+        self.loading.clear()
+        self.loader_hint = None
+        self.in_range.clear()
+        self.requested.clear()
+        self.insert_timer.stop()
+        self.reset_layout()
+        self.layout_cursor = None
         self.items_list.clear()
+        self.item_by_path.clear()
+        self.pool.clear()
+        self.fetcher.request([], self.thumb_width)
         self.scene.clear()
         self.indicator = DropIndicator()
         self.indicator.setZValue(999)
         self.scene.addItem(self.indicator)
         self.indicator.hide()
 
+    def remove_paths(self, paths):
+        """文件被删除/移走时拿掉对应图元，其余图元保持当前顺序重排"""
+        doomed = {self.item_by_path.pop(p) for p in paths if p in self.item_by_path}
+        gone = set(paths)
+        self.pending_items = deque(x for x in self.pending_items if x[1] not in gone)
+        if not doomed: return
+        self.items_list = [i for i in self.items_list if i not in doomed]
+        self.dragging_items = [i for i in self.dragging_items if i not in doomed]
+        for item in doomed:
+            self.pool.discard(item)
+            self.scene.removeItem(item)
+        self.relayout()
+        self.visible_timer.start()
+
     def set_scale(self, width):
+        """换档只改各图元的显示尺寸再重排；级别变了由 update_visible 为视口附近的图换上新一级"""
         self.item_width = width
-        for item in self.items_list:
-            if not item.internal_pixmap.isNull():
-                scale = width / item.internal_pixmap.width()
-                item.setTransform(QTransform().scale(scale, scale))
+        self.thumb_width = thumb_level(width)
+        for item in self.items_list: item.set_display_width(width)
+        self.pool.refresh()  # 底图尺寸跟着变了
         self.relayout()
+        self.update_visible()
 
     def relayout(self):
+        self.reset_layout()
         if not self.items_list: return
+        self.place_items(self.items_list)
+
+    def reset_layout(self):
+        self.layout_cursor = (self.margin, self.margin, 0)
+        self.layout_items = []
+        self.item_rects = []
+        self.row_tops = []
+        self.row_heights = []
+        self.row_first = []
+
+    def layout_appended(self, new_items):
+        """只排新追加到末尾的图元，从上次排版的光标处接着放"""
+        if self.layout_cursor is None:
+            self.relayout()
+        else:
+            self.place_items(new_items)
+
+    def place_items(self, items):
         view_width = self.viewport().width()
-        x = self.margin
-        y = self.margin
-        
-        for item in self.items_list:
-            if item in self.dragging_items: continue
-            current_h = item.boundingRect().height() * item.transform().m11()
+        x, y, row_h = self.layout_cursor
+        dragging = set(self.dragging_items)
+        for item in items:
+            if item in dragging: continue
+            h = item.display_size[1]
+            if x == self.margin:
+                self.row_tops.append(y)
+                self.row_heights.append(0)
+                self.row_first.append(len(self.layout_items))
+            row_h = max(row_h, h)
+            self.row_heights[-1] = row_h
             item.setPos(x, y)
+            self.layout_items.append(item)
+            self.item_rects.append((x, y, self.item_width, h))
             x += self.item_width + self.spacing
             if x + self.item_width > view_width - self.margin:
                 x = self.margin
-                y += current_h + self.spacing
-        total_height = y + 400
+                y += row_h + self.spacing
+                row_h = 0
+        self.layout_cursor = (x, y, row_h)
+        total_height = y + row_h + 400
         self.scene.setSceneRect(0, 0, view_width, max(total_height, self.viewport().height()))
 
     def update_indicator(self, index):
-        if index == -1: 
+        if index == -1 or not self.item_rects: 
             self.indicator.hide()
             return
-        view_width = self.viewport().width()
-        x = self.margin
-        y = self.margin
-        for i in range(index):
-            if i < len(self.items_list):
-                target_item = self.items_list[i]
-                if target_item in self.dragging_items: continue
-                current_h = target_item.boundingRect().height() * target_item.transform().m11()
-            else:
-                current_h = self.item_width * 1.5
-            x += self.item_width + self.spacing
-            if x + self.item_width > view_width - self.margin:
-                x = self.margin
-                y += current_h + self.spacing
-        self.indicator.height = self.item_width * 1.4
+        if index < len(self.item_rects):
+            x, y, _, _ = self.item_rects[index]
+        else:
+            x, y, w, _ = self.item_rects[-1]
+            x += w + self.spacing
+        row = bisect.bisect_right(self.row_tops, y) - 1
         self.indicator.prepareGeometryChange()
+        self.indicator.height = max(20, self.row_heights[row] - 20)
         indicator_x = x - (self.spacing / 2)
         self.indicator.setPos(indicator_x, y + 10)
         self.indicator.show()
@@ -372,6 +1058,8 @@ class FlowLayoutView(QGraphicsView):
             drag_item.setZValue(100)
             drag_item.setOpacity(0.8)
             drag_item.setGraphicsEffect(shadow)
+        # 其余图元先收拢排好，插入位置的判定与最终落点用的是同一份几何
+        self.relayout()
         self.scroll_timer.start(20)
 
     def mouseReleaseEvent(self, event):
@@ -402,29 +1090,99 @@ class FlowLayoutView(QGraphicsView):
             bar.setValue(bar.value() + self.scroll_step)
 
     def calculate_index_at(self, view_pos):
+        """指针所在行用二分查找定位，行内取最近的缝隙；返回值是去掉拖动图元后的插入下标"""
+        if not self.row_tops: return 0
         scene_pos = self.mapToScene(view_pos)
-        min_dist = float('inf')
-        closest_idx = -1
-        view_width = self.viewport().width()
-        x = self.margin
-        y = self.margin
-        temp_list = [i for i in self.items_list if i not in self.dragging_items]
-        for i in range(len(temp_list) + 1):
-            est_h = self.item_width * 1.5
-            center = QPointF(x + self.item_width/2, y + est_h/2)
-            dist = abs(scene_pos.x() - center.x()) + abs(scene_pos.y() - center.y())
-            if dist < min_dist:
-                min_dist = dist
-                closest_idx = i
-            x += self.item_width + self.spacing
-            if x + self.item_width > view_width - self.margin:
-                x = self.margin
-                y += est_h + self.spacing
-        return closest_idx
+        row = max(0, bisect.bisect_right(self.row_tops, scene_pos.y()) - 1)
+        first = self.row_first[row]
+        end = self.row_first[row + 1] if row + 1 < len(self.row_first) else len(self.layout_items)
+        step = self.item_width + self.spacing
+        gap = int(round((scene_pos.x() - self.margin + self.spacing / 2) / step))
+        return first + min(max(gap, 0), end - first)
 
 # =========================================================
 # 5. 封面裁剪弹窗
 # =========================================================
+COVER_PROXY_MAX = 1600  # 裁剪弹窗里预览图的最长边
+
+def open_rows(path, bottom):
+    """打开图片并只解码到第 bottom 行为止（封面是整宽的横条，再往下的行用不到）。
+    只对自上而下顺序解码的单块数据（JPEG、非隔行 PNG）截断，其余格式照常完整解码；
+    解码器提前停下依赖本模块开启的 LOAD_TRUNCATED_IMAGES。"""
+    img = Image.open(path)
+    tile = img.tile
+    if (len(tile) == 1 and tile[0][0] in ("jpeg", "zip") and tuple(tile[0][1]) == (0, 0, img.width, img.height)
+            and not img.info.get("interlace") and 0 < bottom < img.height):
+        img.tile = [(tile[0][0], (0, 0, img.width, bottom)) + tuple(tile[0][2:])]
+        img._size = (img.width, bottom)
+    img.load()
+    return img
+
+COVER_RATIOS = (1.5, 2.8)
+COVER_ANCHORS = {"top": "顶端对齐", "center": "居中", "saliency": "主体（边缘最丰富处）"}
+_COVER_NAME = re.compile(r"封面图(\d+)\.jpg$", re.IGNORECASE)
+
+def cover_target_dir(parent_dir):
+    """封面存到当前文件夹的上一级（上一级不存在时就存在当前文件夹）"""
+    target_dir = os.path.dirname(parent_dir)
+    return target_dir if target_dir and os.path.exists(target_dir) else parent_dir
+
+def cover_names(target_dir, count):
+    """扫描一次目录，按从小到大给出 count 个未被占用的 封面图{idx}.jpg 路径"""
+    used = set()
+    try:
+        with os.scandir(target_dir) as it:
+            for entry in it:
+                m = _COVER_NAME.match(entry.name)
+                if m: used.add(int(m.group(1)))
+    except OSError:
+        pass
+    names, idx = [], 1
+    while len(names) < count:
+        if idx not in used: names.append(os.path.join(target_dir, f"封面图{idx}.jpg"))
+        idx += 1
+    return names
+
+def row_energy(path, rows=128):
+    """低分辨率灰度图的逐行边缘能量，用来估计主体所在的高度"""
+    with Image.open(path) as img:
+        img.draft("L", (rows, rows))
+        small = img.convert("L")
+    small.thumbnail((rows, rows))
+    edges = small.filter(ImageFilter.FIND_EDGES)
+    return list(edges.resize((1, edges.height), Image.Resampling.BOX).getdata())
+
+def cover_box(size, ratio, anchor="top", energy=None):
+    """按比例求封面裁剪框（原图坐标），规则同 CropOverlayItem：整宽横条，原图不够高时改为整高、水平居中。
+    anchor 决定横条的纵向位置，saliency 取逐行能量 energy 之和最大的一段，并列时取最靠上的"""
+    w, h = size
+    cw, ch = w, round(w / ratio)
+    if ch > h: cw, ch = round(h * ratio), h
+    x, free = (w - cw) // 2, h - ch
+    if anchor == "top" or free <= 0:
+        y = 0
+    elif anchor == "saliency" and energy:
+        n = len(energy)
+        k = min(n, max(1, round(n * ch / h)))
+        acc = [0]
+        for e in energy: acc.append(acc[-1] + e)
+        best = max(range(n - k + 1), key=lambda i: acc[i + k] - acc[i])
+        y = min(free, round(best * h / n))
+    else:
+        y = free // 2
+    return (x, y, x + cw, y + ch)
+
+def make_cover(src, dst, ratio, anchor="top"):
+    """在子进程里执行：按比例和锚点裁出封面，只解码到裁剪框底部，按质量 95 保存"""
+    energy = row_energy(src) if anchor == "saliency" else None
+    with Image.open(src) as img:
+        size = img.size
+    box = cover_box(size, ratio, anchor, energy)
+    with open_rows(src, box[3]) as img:
+        cropped = img.crop(box)
+    if cropped.mode != "RGB": cropped = cropped.convert("RGB")
+    cropped.save(dst, quality=95)
+
 class CropOverlayItem(QGraphicsObject):
     def __init__(self, rect_size, parent=None):
         super().__init__(parent)
@@ -531,11 +1289,14 @@ class CoverCropDialog(QDialog):
         layout.addWidget(ctrl_panel)
 
     def load_image(self):
+        """只显示屏幕分辨率的预览（JPEG 用 draft 缩小解码），不保留原图像素；
+        裁剪框在预览坐标下操作，保存时再换算回原图坐标"""
         try:
-            self.pil_img = Image.open(self.image_path)
-            if self.pil_img.mode != "RGBA": self.pil_img = self.pil_img.convert("RGBA")
-            qim = QImage(self.pil_img.tobytes("raw", "RGBA"), self.pil_img.width, self.pil_img.height, QImage.Format.Format_RGBA8888)
-            pixmap = QPixmap.fromImage(qim)
+            with Image.open(self.image_path) as img:
+                self.src_size = img.size
+                img.thumbnail((COVER_PROXY_MAX, COVER_PROXY_MAX), Image.Resampling.LANCZOS, reducing_gap=2.0)
+                self.proxy_image = pil_to_qimage(thumbnail_mode(img))  # pixmap 共享这块缓冲，需一直持有
+            pixmap = QPixmap.fromImage(self.proxy_image)
             self.bg_item = self.scene.addPixmap(pixmap)
             self.overlay = CropOverlayItem((pixmap.width(), pixmap.height()))
             self.overlay.setZValue(10)
@@ -575,25 +1336,583 @@ class CoverCropDialog(QDialog):
     def save_cover(self):
         try:
             rect = self.overlay.crop_rect
-            box = (int(rect.x()), int(rect.y()), int(rect.right()), int(rect.bottom()))
-            cropped = self.pil_img.crop(box)
-            if cropped.mode == "RGBA": cropped = cropped.convert("RGB") 
-            target_dir = os.path.dirname(self.parent_dir)
-            if not target_dir or not os.path.exists(target_dir): target_dir = self.parent_dir 
-            idx = 1
-            while True:
-                filename = f"封面图{idx}.jpg"
-                save_path = os.path.join(target_dir, filename)
-                if not os.path.exists(save_path): break
-                idx += 1
+            src_w, src_h = self.src_size
+            sx, sy = src_w / self.overlay.img_w, src_h / self.overlay.img_h
+            box = (max(0, round(rect.x() * sx)), max(0, round(rect.y() * sy)),
+                   min(src_w, round(rect.right() * sx)), min(src_h, round(rect.bottom() * sy)))
+            with open_rows(self.image_path, box[3]) as img:
+                cropped = img.crop(box)
+            if cropped.mode != "RGB": cropped = cropped.convert("RGB") 
+            save_path = cover_names(cover_target_dir(self.parent_dir), 1)[0]
             cropped.save(save_path, quality=95)
             QMessageBox.information(self, "成功", f"封面已保存至:\n{save_path}")
             self.accept()
         except Exception as e:
             QMessageBox.critical(self, "保存失败", str(e))
 
+class BatchCoverDialog(QDialog):
+    """批量封面的参数：比例与纵向锚点"""
+    def __init__(self, count, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("批量制作封面")
+        layout = QVBoxLayout(self)
+        layout.addWidget(QLabel(f"为选中的 {count} 张图片各生成一张封面"))
+        layout.addWidget(QLabel("横向比例"))
+        self.combo_ratio = QComboBox()
+        for ratio, label in zip(COVER_RATIOS, ("1.5 : 1 (标准)", "2.8 : 1 (超宽)")):
+            self.combo_ratio.addItem(label, ratio)
+        layout.addWidget(self.combo_ratio)
+        layout.addWidget(QLabel("裁剪位置"))
+        self.combo_anchor = QComboBox()
+        for key, label in COVER_ANCHORS.items():
+            self.combo_anchor.addItem(label, key)
+        layout.addWidget(self.combo_anchor)
+        buttons = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout.addWidget(buttons)
+
+def format_failures(failures, limit=10):
+    """完成提示里附上的失败清单：[(路径, 出错信息), ...]，最多列 limit 条"""
+    if not failures: return ""
+    lines = [f"{os.path.basename(p)}: {err}" for p, err in failures[:limit]]
+    if len(failures) > limit: lines.append(f"……等共 {len(failures)} 张")
+    return f"\n\n失败 {len(failures)} 张:\n" + "\n".join(lines)
+
+class BatchCoverThread(QThread):
+    """批量封面：裁剪和编码分发到进程池，同时最多 workers*2 个任务在途；可中途取消。
+    失败的按 (原图, 出错信息) 收集，随结果一起发出"""
+    progress_signal = pyqtSignal(int, int)
+    done_signal = pyqtSignal(int, bool, object)  # 成功张数, 是否被取消, [(原图, 出错信息), ...]
+
+    def __init__(self, tasks, ratio, anchor="top", workers=None):
+        super().__init__()
+        self.tasks = tasks
+        self.ratio = ratio
+        self.anchor = anchor
+        self.workers = workers or os.cpu_count() or 4
+        self.is_running = True
+
+    def run(self):
+        total = len(self.tasks)
+        count = finished = 0
+        failures = []
+        todo = iter(self.tasks)
+        in_flight = deque()
+        with ProcessPoolExecutor(max_workers=max(1, min(self.workers, total))) as pool:
+            def submit_next():
+                for src, dst in todo:
+                    in_flight.append((src, pool.submit(make_cover, src, dst, self.ratio, self.anchor)))
+                    return
+            for _ in range(self.workers * 2): submit_next()
+            while in_flight:
+                src, future = in_flight.popleft()
+                if future.cancelled(): continue
+                try:
+                    future.result()
+                    count += 1
+                except Exception as e:
+                    failures.append((src, str(e) or type(e).__name__))
+                finished += 1
+                self.progress_signal.emit(finished, total)
+                if self.is_running: submit_next()
+                else:
+                    for _, f in in_flight: f.cancel()
+        self.done_signal.emit(count, not self.is_running, failures)
+
+    def stop(self):
+        self.is_running = False
+
 # =========================================================
-# 6. 主窗口
+# 6. 后台导出
+# =========================================================
+def export_one_jpg(src, dst):
+    """在子进程里执行。本来就是 RGB 的 JPEG 原样拷贝（重新编码只会损失画质、白费时间），
+    其余转 RGB 后按质量 95 编码。返回是否走了拷贝。"""
+    with Image.open(src) as img:
+        if not (img.format == "JPEG" and img.mode == "RGB"):
+            if img.mode != 'RGB': img = img.convert('RGB')
+            img.save(dst, quality=95)
+            return False
+    shutil.copyfile(src, dst)
+    return True
+
+class ExportJpgThread(QThread):
+    """按元数据索引分流：RGB 的 JPEG 在本线程直接拷贝，其余分发到进程池，
+    同时最多 workers*2 个任务在途；可中途取消。失败的按 (原图, 出错信息) 收集，随结果一起发出"""
+    progress_signal = pyqtSignal(int, int)
+    done_signal = pyqtSignal(int, int, bool, object)  # 成功张数, 其中直接拷贝的张数, 是否被取消, [(原图, 出错信息), ...]
+
+    def __init__(self, tasks, cache=None, workers=None):
+        super().__init__()
+        self.tasks = tasks
+        self.cache = cache
+        self.workers = workers or os.cpu_count() or 4
+        self.is_running = True
+
+    def run(self):
+        total = len(self.tasks)
+        count = copied = finished = 0
+        failures = []
+        index = build_meta_index([src for src, _ in self.tasks], self.cache)
+        convert = []
+        for src, dst in self.tasks:
+            meta = index.get(src)
+            if meta is None or meta[2] != "RGB" or meta[3] != "JPEG":
+                convert.append((src, dst))
+                continue
+            if not self.is_running: break
+            try:
+                shutil.copyfile(src, dst)
+                count += 1
+                copied += 1
+            except Exception as e:
+                failures.append((src, str(e) or type(e).__name__))
+            finished += 1
+            self.progress_signal.emit(finished, total)
+        if not self.is_running or not convert:
+            self.done_signal.emit(count, copied, not self.is_running, failures)
+            return
+        todo = iter(convert)
+        in_flight = deque()
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(convert))) as pool:
+            def submit_next():
+                for src, dst in todo:
+                    in_flight.append((src, pool.submit(export_one_jpg, src, dst)))
+                    return
+            for _ in range(self.workers * 2): submit_next()
+            while in_flight:
+                src, future = in_flight.popleft()
+                if future.cancelled(): continue
+                try:
+                    copied += future.result()
+                    count += 1
+                except Exception as e:
+                    failures.append((src, str(e) or type(e).__name__))
+                finished += 1
+                self.progress_signal.emit(finished, total)
+                if self.is_running: submit_next()
+                else:
+                    for _, f in in_flight: f.cancel()
+        self.done_signal.emit(count, copied, not self.is_running, failures)
+
+    def stop(self):
+        self.is_running = False
+
+# PDF 导出档位：max_width 为嵌入像素的最大宽度（None 保留原图），quality 为重新编码的 JPEG 质量（None 无损），
+# max_bpp 为每像素字节数的上限（None 不限）：超过的原图 JPEG 也要重新编码，编码结果超过时逐页降低质量
+PDF_PROFILES = {
+    "archive": {"label": "原图 (archive)", "max_width": None, "quality": None, "max_bpp": None},
+    "screen": {"label": "屏幕 (screen)", "max_width": 1600, "quality": 85, "max_bpp": 0.4},
+    "preview": {"label": "预览 (preview)", "max_width": 800, "quality": 60, "max_bpp": 0.2},
+}
+PDF_MIN_QUALITY = 40  # 按 max_bpp 降质量时的下限
+
+def prepare_pdf_image(path, max_width=None, quality=None, max_bpp=None):
+    """准备一页的图像流（在子进程里执行）。
+
+    不需要缩小、也没超过 max_bpp 的 RGB/灰度 JPEG 直接引用原文件按 DCTDecode 嵌入（不解码、不重新编码）；
+    其余解码后转 RGB（透明部分铺白底），超过 max_width 的缩小，
+    给了 quality 就编码成 JPEG（超过 max_bpp 时每次降 10 重新编码，最低 PDF_MIN_QUALITY），
+    否则用 FlateDecode 无损压缩。"""
+    with Image.open(path) as img:
+        w, h = img.size
+        shrink = max_width is not None and w > max_width
+        oversized = max_bpp is not None and os.path.getsize(path) > max_bpp * w * h
+        if img.format == "JPEG" and img.mode in ("RGB", "L") and not shrink and not oversized:
+            colorspace = b"DeviceRGB" if img.mode == "RGB" else b"DeviceGray"
+            return {"w": w, "h": h, "colorspace": colorspace, "filter": b"DCTDecode", "data": None, "path": path}
+        if shrink:
+            w, h = max_width, max(1, round(h * max_width / w))
+            if img.format == "JPEG": img.draft(img.mode, (w, h))
+        if img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info:
+            rgba = img.convert("RGBA")
+            img = Image.new("RGB", rgba.size, (255, 255, 255))
+            img.paste(rgba, mask=rgba.getchannel("A"))
+        elif img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        if shrink: img = img.resize((w, h), Image.Resampling.LANCZOS, reducing_gap=2.0)
+        colorspace = b"DeviceRGB" if img.mode == "RGB" else b"DeviceGray"
+        if quality is not None:
+            while True:
+                buf = io.BytesIO()
+                img.save(buf, "JPEG", quality=quality)
+                if max_bpp is None or quality <= PDF_MIN_QUALITY or buf.tell() <= max_bpp * w * h: break
+                quality = max(PDF_MIN_QUALITY, quality - 10)
+            return {"w": w, "h": h, "colorspace": colorspace, "filter": b"DCTDecode", "data": buf.getvalue(), "path": None}
+        data = zlib.compress(img.tobytes(), 6)
+    return {"w": w, "h": h, "colorspace": colorspace, "filter": b"FlateDecode", "data": data, "path": None}
+
+class PdfWriter:
+    """极简的增量 PDF 写出器：每页的图像、内容流和页对象写完就落盘，
+    内存里只留对象偏移；页树（2 号）和目录（1 号）在 close 时最后写。"""
+    def __init__(self, path):
+        self.f = open(path, "wb")
+        self.offsets = {}
+        self.page_ids = []
+        self.next_id = 3
+        self.f.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _alloc(self):
+        obj_id = self.next_id
+        self.next_id += 1
+        return obj_id
+
+    def _begin(self, obj_id):
+        self.offsets[obj_id] = self.f.tell()
+        self.f.write(b"%d 0 obj\n" % obj_id)
+
+    def _write_stream(self, obj_id, entries, data=None, src_path=None):
+        length = os.path.getsize(src_path) if src_path else len(data)
+        self._begin(obj_id)
+        self.f.write(b"<< " + entries + b" /Length %d >>\nstream\n" % length)
+        if src_path:
+            with open(src_path, "rb") as src: shutil.copyfileobj(src, self.f, 1 << 20)
+        else:
+            self.f.write(data)
+        self.f.write(b"\nendstream\nendobj\n")
+
+    def add_image_page(self, image, page_w, page_h, x, y, draw_w, draw_h):
+        """image 来自 prepare_pdf_image；尺寸与位置单位为 pt"""
+        img_id, content_id, page_id = self._alloc(), self._alloc(), self._alloc()
+        entries = (b"/Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /%s "
+                   b"/BitsPerComponent 8 /Filter /%s" % (image["w"], image["h"], image["colorspace"], image["filter"]))
+        self._write_stream(img_id, entries, image["data"], image["path"])
+        self._write_stream(content_id, b"", b"q %.2f 0 0 %.2f %.2f %.2f cm /Im0 Do Q" % (draw_w, draw_h, x, y))
+        self._begin(page_id)
+        self.f.write(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.2f %.2f] "
+                     b"/Resources << /XObject << /Im0 %d 0 R >> >> /Contents %d 0 R >>\nendobj\n"
+                     % (page_w, page_h, img_id, content_id))
+        self.page_ids.append(page_id)
+
+    def close(self):
+        kids = b" ".join(b"%d 0 R" % i for i in self.page_ids)
+        self._begin(2)
+        self.f.write(b"<< /Type /Pages /Kids [%s] /Count %d >>\nendobj\n" % (kids, len(self.page_ids)))
+        self._begin(1)
+        self.f.write(b"<< /Type /Catalog /Pages 2 0 R >>\nendobj\n")
+        xref_pos = self.f.tell()
+        self.f.write(b"xref\n0 %d\n0000000000 65535 f \n" % self.next_id)
+        for obj_id in range(1, self.next_id):
+            self.f.write(b"%010d 00000 n \n" % self.offsets[obj_id])
+        self.f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (self.next_id, xref_pos))
+        self.f.close()
+
+    def abort(self):
+        self.f.close()
+        try: os.remove(self.f.name)
+        except OSError: pass
+
+class ExportPdfThread(QThread):
+    """逐页生成 PDF：先从元数据索引（只读文件头）拿尺寸定页宽，各页图像在进程池里并行准备
+    （同时最多 workers*2 页在途），再按顺序一页一页写出，内存占用与页数无关。
+    各档位的页面尺寸相同，只是嵌入的像素不同。读不出来的图跳过但计入进度，按 (路径, 出错信息) 随结果发出；
+    一页都没写成时删掉半成品文件并报错。"""
+    progress_signal = pyqtSignal(int, int)
+    done_signal = pyqtSignal(int, bool, str, float, object)  # 页数, 是否被取消, 错误信息, 耗时(秒), [(路径, 出错信息), ...]
+
+    def __init__(self, paths, save_path, profile="archive", cache=None, margin=20, workers=None):
+        super().__init__()
+        self.paths = paths
+        self.save_path = save_path
+        self.cache = cache
+        self.profile = PDF_PROFILES[profile]
+        self.margin = margin
+        self.workers = workers or os.cpu_count() or 4
+        self.is_running = True
+
+    def run(self):
+        t0 = time.perf_counter()
+        total = len(self.paths)
+        index = build_meta_index(self.paths, self.cache)
+        sizes = [(p, index[p][:2]) for p in self.paths if p in index]
+        failures = [(p, "无法读取图片") for p in self.paths if p not in index]
+        finished = len(failures)
+        if finished: self.progress_signal.emit(finished, total)
+        if not sizes:
+            self.done_signal.emit(0, False, "没有可用的图片", 0.0, failures)
+            return
+        margin = self.margin
+        page_w = max(w for _, (w, _) in sizes) + margin * 2
+        draw_w = page_w - margin * 2
+        max_width, quality, max_bpp = self.profile["max_width"], self.profile["quality"], self.profile["max_bpp"]
+        pages = 0
+        try:
+            writer = PdfWriter(self.save_path)
+        except Exception as e:
+            self.done_signal.emit(0, False, str(e), 0.0, failures)
+            return
+        try:
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(sizes))) as pool:
+                todo = iter(sizes)
+                in_flight = deque()
+                def submit_next():
+                    for p, size in todo:
+                        in_flight.append((p, size, pool.submit(prepare_pdf_image, p, max_width, quality, max_bpp)))
+                        return
+                for _ in range(self.workers * 2): submit_next()
+                while in_flight:
+                    p, (w, h), future = in_flight.popleft()
+                    if future.cancelled(): continue
+                    try: image = future.result()
+                    except Exception as e:
+                        image = None
+                        failures.append((p, str(e) or type(e).__name__))
+                    if image is not None and self.is_running:
+                        draw_h = h * draw_w / w
+                        writer.add_image_page(image, page_w, draw_h + margin * 2, margin, margin, draw_w, draw_h)
+                        pages += 1
+                    finished += 1
+                    self.progress_signal.emit(finished, total)
+                    if self.is_running: submit_next()
+                    else:
+                        for _, _, f in in_flight: f.cancel()
+            if not self.is_running or pages == 0: writer.abort()
+            else: writer.close()
+        except Exception as e:
+            writer.abort()
+            self.done_signal.emit(pages, False, str(e), time.perf_counter() - t0, failures)
+            return
+        error = "" if pages or not self.is_running else "没有一张图片能写入 PDF"
+        self.done_signal.emit(pages, not self.is_running, error, time.perf_counter() - t0, failures)
+
+    def stop(self):
+        self.is_running = False
+
+# =========================================================
+# 7. 相似图查找
+# =========================================================
+DUP_HASH_DISTANCE = 6  # dHash 汉明距离不超过它就算近似重复（64 位中）
+
+def dhash_image(path, cache=None):
+    """64 位 dHash：缩成 9x8 灰度后比较左右相邻像素。优先用缓存里最小一级的缩略图，
+    没有才解码原图（draft 缩小解码），不碰全尺寸像素。"""
+    st = os.stat(path)
+    if cache is not None:
+        known = cache.get_hash(path, st)
+        if known is not None: return known, None
+    img = None
+    if cache is not None:
+        for level in THUMB_LEVELS:
+            data = cache.get(path, st, level)
+            if data is not None:
+                img = Image.open(io.BytesIO(data))
+                break
+    if img is None: img = decode_thumbnail(path, THUMB_LEVELS[0])[0]
+    pixels = list(img.convert("L").resize((9, 8), Image.Resampling.BOX).getdata())
+    h = 0
+    for row in range(8):
+        for col in range(8):
+            h = (h << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return h, st
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+def hash_spans(radius, bits=64):
+    """把哈希切成 radius+1 段的 (右移位数, 掩码)：汉明距离不超过 radius 的两个哈希
+    至少有一段完全相同（抽屉原理），按段分桶即可只比较同桶的候选"""
+    n = radius + 1
+    spans, shift = [], 0
+    for k in range(n):
+        width = bits // n + (1 if k < bits % n else 0)
+        spans.append((shift, (1 << width) - 1))
+        shift += width
+    return spans
+
+def cluster_by_hash(hashes, radius=DUP_HASH_DISTANCE):
+    """hashes: [(路径, dHash)]；返回近似重复的分组（每组 >= 2 张，组内与组间都保持输入顺序）。
+    多段索引查候选，并查集合并，万张量级只需一两秒。哈希完全相同的（连拍、导出的副本）
+    直接并到第一张，只有各个不同的哈希的代表进索引比较，大量同图时不会退化成两两比较。"""
+    spans = hash_spans(radius)
+    tables = [{} for _ in spans]
+    parent = list(range(len(hashes)))
+    first = {}  # dHash -> 第一次出现的下标
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    for i, (_, h) in enumerate(hashes):
+        if h in first:
+            ri, rj = find(i), find(first[h])
+            if ri != rj: parent[max(ri, rj)] = min(ri, rj)
+            continue
+        first[h] = i
+        candidates = set()
+        for table, (shift, mask) in zip(tables, spans):
+            bucket = table.setdefault((h >> shift) & mask, [])
+            candidates.update(bucket)
+            bucket.append(i)
+        for j in candidates:
+            if hamming(h, hashes[j][1]) <= radius:
+                ri, rj = find(i), find(j)
+                if ri != rj: parent[max(ri, rj)] = min(ri, rj)
+    groups = {}
+    for i, (p, _) in enumerate(hashes): groups.setdefault(find(i), []).append(p)
+    return [g for _, g in sorted(groups.items()) if len(g) > 1]
+
+class DuplicateScanThread(QThread):
+    """后台计算感知哈希（线程池并行，结果写回缓存）并聚类近似重复图；
+    stop() 后剩下的图不再计算，已算出的哈希照常写回缓存，不发出结果"""
+    progress_signal = pyqtSignal(int, int)
+    done_signal = pyqtSignal(object)  # [[路径, ...], ...]
+
+    def __init__(self, paths, cache=None, workers=None):
+        super().__init__()
+        self.paths = paths
+        self.cache = cache
+        self.workers = workers or min(16, os.cpu_count() or 4)
+        self.is_running = True
+
+    def run(self):
+        def one(p):
+            if not self.is_running: return None
+            try: return dhash_image(p, self.cache)
+            except Exception: return None
+        hashes, fresh = [], []
+        total = len(self.paths)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for i, (p, result) in enumerate(zip(self.paths, pool.map(one, self.paths))):
+                if result is not None:
+                    hashes.append((p, result[0]))
+                    if result[1] is not None: fresh.append((p, result[1], result[0]))
+                if not self.is_running: break
+                if i % 50 == 0: self.progress_signal.emit(i + 1, total)
+        if self.cache is not None and fresh:
+            try: self.cache.put_hashes(fresh)
+            except Exception as e: print(f"哈希缓存写入失败: {e}")
+        if self.is_running: self.done_signal.emit(cluster_by_hash(hashes))
+
+    def stop(self):
+        self.is_running = False
+
+# =========================================================
+# 8. Photoshop 批处理
+# =========================================================
+class PhotoshopClient(ABC):
+    """批处理用到的 Photoshop 操作。Win32PhotoshopClient 通过 COM 连接真实的 PS；
+    没有 PS 的环境（基准测试）在 benchmarks/bench_ps_batch.py 里另有本地模拟的实现"""
+    @abstractmethod
+    def document_count(self): ...
+
+    @abstractmethod
+    def suppress_dialogs(self):
+        """关掉 PS 的弹窗，返回原设置供 restore_dialogs 恢复"""
+
+    @abstractmethod
+    def restore_dialogs(self, mode): ...
+
+    @abstractmethod
+    def save_and_close_active(self):
+        """保存并关闭当前文档，返回 (文档名, 出错信息)；保存失败时不保存直接关闭，
+        连关闭都失败才抛异常"""
+
+    def close(self):
+        pass
+
+class Win32PhotoshopClient(PhotoshopClient):
+    """COM 对象只能在创建它的线程里用：后台线程要自己建一个客户端"""
+    def __init__(self):
+        pythoncom.CoInitialize()
+        try:
+            try:
+                self.app = win32com.client.GetActiveObject("Photoshop.Application")
+            except Exception:
+                self.app = win32com.client.Dispatch("Photoshop.Application")
+        except Exception:
+            pythoncom.CoUninitialize()
+            raise
+        self.jpg_opts = None
+
+    def document_count(self):
+        return self.app.Documents.Count
+
+    def suppress_dialogs(self):
+        mode = self.app.DisplayDialogs
+        self.app.DisplayDialogs = 3  # 3 = psDisplayNoDialogs (不显示弹窗)
+        return mode
+
+    def restore_dialogs(self, mode):
+        self.app.DisplayDialogs = mode
+
+    def jpeg_options(self):
+        # 预先填好 JPEG 保存选项，防止弹窗
+        if self.jpg_opts is None:
+            self.jpg_opts = win32com.client.Dispatch("Photoshop.JPEGSaveOptions")
+            self.jpg_opts.EmbedColorProfile = True
+            self.jpg_opts.FormatOptions = 1 # 1 = Standard
+            self.jpg_opts.Matte = 1 # 1 = No Matte
+            self.jpg_opts.Quality = 12 # 0-12, 12是最佳质量
+        return self.jpg_opts
+
+    def save_and_close_active(self):
+        doc = self.app.ActiveDocument
+        name = doc.Name
+        try:
+            if name.lower().endswith(('.jpg', '.jpeg')):
+                # JPG 用 SaveAs 覆盖原文件以应用选项；参数: 路径, 选项, 是否作为副本, 扩展名大小写(2=lower)
+                doc.SaveAs(doc.FullName, self.jpeg_options(), False, 2)
+                doc.Close(2)  # 上面已经存过了，2 = DoNotSaveChanges
+            else:
+                doc.Close(1)  # PSD、PNG 等直接 1 = SaveChanges，配合不弹窗设置
+            return name, ""
+        except Exception as e:
+            doc.Close(2)  # 保存失败就不保存强制关闭，防止卡死循环
+            return name, str(e)
+
+    def close(self):
+        self.app = self.jpg_opts = None
+        pythoncom.CoUninitialize()
+
+class PsBatchThread(QThread):
+    """在后台逐个保存并关闭 PS 里打开的文档，每完成一个报告进度和耗时；
+    取消在两个文档之间生效。client_factory 在本线程里创建客户端"""
+    progress_signal = pyqtSignal(int, int)
+    doc_signal = pyqtSignal(str, float, str)  # 文档名, 耗时(秒), 出错信息
+    done_signal = pyqtSignal(int, int, bool, str)  # 处理的文档数, 其中保存失败的, 是否被取消, 中断原因
+
+    def __init__(self, client_factory, total=0):
+        super().__init__()
+        self.client_factory = client_factory
+        self.total = total
+        self.timings = []  # (文档名, 耗时, 出错信息)
+        self.is_running = True
+
+    def run(self):
+        try:
+            client = self.client_factory()
+        except Exception as e:
+            self.done_signal.emit(0, 0, False, f"未能连接到 Photoshop: {e}")
+            return
+        finished = failed = 0
+        error = ""
+        try:
+            mode = client.suppress_dialogs()
+            try:
+                while self.is_running and client.document_count() > 0:
+                    t0 = time.perf_counter()
+                    name, doc_error = client.save_and_close_active()
+                    seconds = time.perf_counter() - t0
+                    self.timings.append((name, seconds, doc_error))
+                    finished += 1
+                    if doc_error: failed += 1
+                    self.doc_signal.emit(name, seconds, doc_error)
+                    self.progress_signal.emit(finished, max(self.total, finished))
+            finally:
+                # 恢复 PS 的弹窗设置，以免影响用户后续手动操作
+                client.restore_dialogs(mode)
+        except Exception as e:
+            error = str(e)
+        finally:
+            client.close()
+        self.done_signal.emit(finished, failed, not self.is_running, error)
+
+    def stop(self):
+        self.is_running = False
+
+# =========================================================
+# 9. 主窗口
 # =========================================================
 class FocusImageMain(QMainWindow):
     def __init__(self):
@@ -607,9 +1926,27 @@ class FocusImageMain(QMainWindow):
         self.last_open_dir = ""  
         self.ps_path = "" 
         self.is_dark_mode = True 
+        self.loader = None
+        self.export_worker = None
+        self.dup_worker = None
+        self.ps_client_factory = Win32PhotoshopClient if HAS_WIN32 else None  # 没有 pywin32 时批处理不可用
+        self.thumb_cache = self.open_thumb_cache()
+        self.folder_listings = {}  # 文件夹 → (目录 mtime, 排好序的图片路径)
+        self.unreadable = {}  # 当前文件夹里读不出文件头的图 → 当时的 mtime
+        # ComfyUI 往当前文件夹写新图时增量加入，删掉的图直接移除；目录事件合并后再处理
+        self.watcher = QFileSystemWatcher(self)
+        self.rescan_timer = QTimer(self)
+        self.rescan_timer.setSingleShot(True)
+        self.rescan_timer.setInterval(500)
+        self.rescan_timer.timeout.connect(self.rescan_folder)
+        self.watcher.directoryChanged.connect(lambda _: self.rescan_timer.start())
         self.setup_ui()
         self.load_last_config()
         self.apply_theme()
+        self.pool_timer = QTimer(self)
+        self.pool_timer.setInterval(1000)
+        self.pool_timer.timeout.connect(self.update_pool_label)
+        self.pool_timer.start()
 
     def setup_ui(self):
         main_widget = QWidget()
@@ -623,6 +1960,9 @@ class FocusImageMain(QMainWindow):
         self.lbl_path = QLabel("未选择文件夹")
         self.lbl_path.setStyleSheet("font-size: 16px; font-weight: bold;")
         top_bar.addWidget(self.lbl_path)
+        self.lbl_pool = QLabel()
+        self.lbl_pool.setStyleSheet("color: #888;")
+        top_bar.addWidget(self.lbl_pool)
         top_bar.addStretch()
         
         btn_sel_all = QPushButton("☑️ 全选")
@@ -635,6 +1975,11 @@ class FocusImageMain(QMainWindow):
         btn_sel_inv.clicked.connect(self.invert_selection)
         top_bar.addWidget(btn_sel_inv)
 
+        self.btn_dup = QPushButton("🔍 选中重复")
+        self.btn_dup.setToolTip("查找近似重复的图片，每组保留第一张，其余选中")
+        self.btn_dup.clicked.connect(self.select_duplicates)
+        top_bar.addWidget(self.btn_dup)
+
         self.btn_theme = QPushButton("☀️/🌙")
         self.btn_theme.setFixedWidth(60)
         self.btn_theme.clicked.connect(self.toggle_theme)
@@ -651,11 +1996,17 @@ class FocusImageMain(QMainWindow):
         
         self.view = FlowLayoutView()
         self.view.item_width = self.scale_levels[self.current_scale_key]
+        self.view.pool.budget = int(self.config_value("thumb_memory_mb", THUMB_MEMORY_DEFAULT_MB)) * 1024 * 1024
         layout.addWidget(self.view)
         
         self.progress_bar = QProgressBar()
         self.progress_bar.hide()
         layout.addWidget(self.progress_bar)
+        # 查重单独一条进度：和加载同时进行时互不覆盖、互不隐藏
+        self.dup_progress = QProgressBar()
+        self.dup_progress.setFormat("查重 %p%")
+        self.dup_progress.hide()
+        layout.addWidget(self.dup_progress)
         
         # --- 底部工具栏 ---
         btm_bar = QHBoxLayout()
@@ -712,6 +2063,12 @@ class FocusImageMain(QMainWindow):
         btn_jpg.clicked.connect(self.export_jpg)
         btm_bar.addWidget(btn_jpg)
         
+        self.combo_pdf = QComboBox()
+        for key, profile in PDF_PROFILES.items(): self.combo_pdf.addItem(profile["label"], key)
+        self.combo_pdf.setFixedWidth(140)
+        self.combo_pdf.setFixedHeight(40)
+        btm_bar.addWidget(self.combo_pdf)
+
         btn_pdf = QPushButton("📄 生成 PDF")
         btn_pdf.setFixedHeight(45)
         btn_pdf.clicked.connect(self.export_pdf)
@@ -724,6 +2081,32 @@ class FocusImageMain(QMainWindow):
     def invert_selection(self):
         for item in self.view.items_list: item.setSelected(not item.isSelected())
 
+    def select_duplicates(self):
+        paths = [item.path for item in self.view.items_list if not item.broken]
+        if not paths or (self.dup_worker is not None and self.dup_worker.isRunning()): return
+        worker = DuplicateScanThread(paths, self.thumb_cache)
+        self.btn_dup.setEnabled(False)
+        self.dup_progress.setValue(0)
+        self.dup_progress.show()
+        worker.progress_signal.connect(lambda c, t: self.dup_progress.setValue(int(c/t*100)))
+
+        def done(groups):
+            self.btn_dup.setEnabled(True)
+            self.dup_progress.hide()
+            for sel in self.view.scene.selectedItems(): sel.setSelected(False)
+            # 按当前视图顺序，每组保留最靠前的一张
+            order = {item.path: i for i, item in enumerate(self.view.items_list)}
+            picked = 0
+            for group in groups:
+                for p in sorted((p for p in group if p in order), key=order.get)[1:]:
+                    self.view.item_by_path[p].setSelected(True)
+                    picked += 1
+            if groups: QMessageBox.information(self, "查重", f"找到 {len(groups)} 组近似重复，已选中 {picked} 张（每组保留第一张）")
+            else: QMessageBox.information(self, "查重", "没有找到近似重复的图片")
+        worker.done_signal.connect(done)
+        self.dup_worker = worker
+        worker.start()
+
     def toggle_theme(self):
         self.is_dark_mode = not self.is_dark_mode
         self.apply_theme()
@@ -732,6 +2115,15 @@ class FocusImageMain(QMainWindow):
         if self.is_dark_mode: QApplication.instance().setStyleSheet(STYLE_DARK)
         else: QApplication.instance().setStyleSheet(STYLE_LIGHT)
 
+    def update_pool_label(self):
+        """顶栏显示像素池占用，悬停看命中 / 回收计数"""
+        st = self.view.pool.stats()
+        mb = 1024 * 1024
+        self.lbl_pool.setText(f"缩略图内存 {st['bytes'] / mb:.0f}/{st['budget'] / mb:.0f} MB")
+        lookups = st["hits"] + st["misses"]
+        rate = f"（命中率 {st['hits'] / lookups:.0%}）" if lookups else ""
+        self.lbl_pool.setToolTip(f"驻留 {st['items']} 张\n命中 {st['hits']}，未命中 {st['misses']}{rate}\n回收 {st['evictions']} 次")
+
     def change_scale(self, text):
         self.current_scale_key = text
         self.view.set_scale(self.scale_levels[text])
@@ -745,33 +2137,134 @@ class FocusImageMain(QMainWindow):
         folder = QFileDialog.getExistingDirectory(self, "选择文件夹", start_dir)
         if folder: self.load_images(folder)
 
+    def closeEvent(self, event):
+        if self.loader is not None and self.loader.isRunning(): self.loader.stop()
+        if self.export_worker is not None and self.export_worker.isRunning():
+            self.export_worker.stop()
+            self.export_worker.wait()
+        if self.dup_worker is not None and self.dup_worker.isRunning():
+            self.dup_worker.stop()
+            self.dup_worker.wait()
+        self.view.fetcher.stop()
+        if self.thumb_cache is not None:
+            try: self.thumb_cache.commit()
+            except Exception: pass
+        super().closeEvent(event)
+
+    def config_value(self, key, default):
+        try:
+            with open(self.config_file, 'r', encoding='utf-8') as f:
+                return json.load(f).get(key, default)
+        except Exception:
+            return default
+
+    def open_thumb_cache(self):
+        budget_mb = int(self.config_value("thumb_cache_mb", THUMB_CACHE_DEFAULT_MB))
+        try:
+            db_path = os.path.join(os.path.dirname(self.config_file), THUMB_CACHE_FILE)
+            return ThumbnailCache(db_path, budget_mb * 1024 * 1024)
+        except Exception as e:
+            print(f"缩略图缓存不可用: {e}")
+            return None
+
+    def list_folder(self, folder):
+        """目录 mtime 没变就直接用上次的列表（增删文件都会改目录 mtime）"""
+        mtime = os.stat(folder).st_mtime_ns
+        cached = self.folder_listings.get(folder)
+        if cached is not None and cached[0] == mtime: return cached[1]
+        files = scan_image_folder(folder)
+        self.folder_listings[folder] = (mtime, files)
+        return files
+
+    def watch_folder(self, folder):
+        watched = self.watcher.directories()
+        if watched: self.watcher.removePaths(watched)
+        self.watcher.addPath(folder)
+
+    def rescan_folder(self):
+        folder = self.last_open_dir
+        if not folder or not os.path.isdir(folder): return
+        if self.loader is not None and self.loader.isRunning():
+            self.rescan_timer.start()  # 等这一轮加载完再比对
+            return
+        try: files = self.list_folder(folder)
+        except OSError: return
+        known = set(self.view.item_by_path)
+        known.update(x[1] for x in self.view.pending_items)
+        current = set(files)
+        removed = [p for p in known if p not in current]
+        added, settling = [], False
+        now = time.time()
+        for p in files:
+            if p in known: continue
+            try: st = os.stat(p)
+            except OSError: continue
+            if self.unreadable.get(p) == st.st_mtime_ns: continue  # 坏图没改过，不再重试
+            young = now - st.st_mtime < 1.0
+            if young: settling = True  # 可能还没写完，过一会儿再看
+            else: added.append(p)
+        if removed: self.view.remove_paths(removed)
+        if added: self.start_loader(added, merge=True)
+        if settling: self.rescan_timer.start()
+
+    def remember_unreadable(self, files, entries):
+        """记下读不出文件头的图和当时的 mtime：它们不会变成图元，不记的话每次目录事件都会再加载一遍"""
+        readable = {p for p, _ in entries}
+        for p in files:
+            if p in readable:
+                self.unreadable.pop(p, None)
+                continue
+            try: self.unreadable[p] = os.stat(p).st_mtime_ns
+            except OSError: pass
+
     def load_images(self, folder):
+        if self.loader is not None and self.loader.isRunning(): self.loader.stop()
+        self.rescan_timer.stop()
+        self.unreadable.clear()
         self.last_open_dir = folder
         self.save_config(folder)
         self.lbl_path.setText(f"{os.path.basename(folder)}")
         self.lbl_path.setToolTip(folder)
         self.view.clear_items()
-        exts = ('.jpg', '.png', '.jpeg', '.bmp', '.gif', '.webp')
-        try:
-            files = [os.path.join(folder, f) for f in os.listdir(folder) if f.lower().endswith(exts)]
-            files.sort(key=lambda s: [int(x) if x.isdigit() else x.lower() for x in re.split(r'(\d+)', os.path.basename(s))])
+        try: files = self.list_folder(folder)
         except Exception: files = []
+        self.watch_folder(folder)
         if not files:
             QMessageBox.information(self, "提示", "没有找到图片")
             return
         self.progress_bar.show()
-        width = self.scale_levels[self.current_scale_key]
-        self.loader = ImageLoaderThread(files, width)
-        self.loader.item_loaded_signal.connect(self.view.add_item_from_pil)
-        self.loader.progress_signal.connect(lambda c, t: self.progress_bar.setValue(int(c/t*100)))
-        self.loader.finished.connect(self.progress_bar.hide)
-        self.loader.start()
+        self.start_loader(files)
+
+    def start_loader(self, files, merge=False):
+        level = thumb_level(self.scale_levels[self.current_scale_key])
+        self.view.set_thumb_source(self.thumb_cache, level)
+        loader = ImageLoaderThread(files, level, self.thumb_cache)
+        self.loader = loader
+        self.view.expect_loader(files, level, loader.prioritize)
+
+        def on_meta(entries):
+            # 旧线程停止前已排队的信号可能在换目录后才送达，按线程过滤掉
+            if self.loader is not loader: return
+            self.remember_unreadable(files, entries)
+            self.view.add_placeholders(entries, merge)
+        loader.meta_signal.connect(on_meta)
+        loader.item_loaded_signal.connect(lambda img, p: self.view.add_item_from_image(img, p, level) if self.loader is loader else None)
+        loader.progress_signal.connect(lambda c, t: self.progress_bar.setValue(int(c/t*100)) if self.loader is loader else None)
+        def on_finished():
+            if self.loader is not loader: return
+            self.progress_bar.hide()
+            self.view.loader_finished()
+        loader.finished.connect(on_finished)
+        loader.start()
 
     def open_cover_maker(self):
         selected_items = self.view.scene.selectedItems()
         img_items = [i for i in selected_items if isinstance(i, ThumbnailItem)]
-        if len(img_items) != 1:
-            QMessageBox.warning(self, "提示", "请先选中一张图片作为封面素材！\n(只能选中一张)")
+        if not img_items:
+            QMessageBox.warning(self, "提示", "请先选中图片作为封面素材！\n(选中一张可手动调整，选中多张批量生成)")
+            return
+        if len(img_items) > 1:
+            self.batch_covers([i.path for i in self.view.items_list if i.isSelected()])
             return
         target_item = img_items[0]
         if not os.path.exists(target_item.path):
@@ -781,6 +2274,26 @@ class FocusImageMain(QMainWindow):
         dialog = CoverCropDialog(target_item.path, current_dir, self)
         dialog.exec()
 
+    def batch_covers(self, paths):
+        paths = [p for p in paths if os.path.exists(p)]
+        if not paths: return
+        options = BatchCoverDialog(len(paths), self)
+        if not options.exec(): return
+        target_dir = cover_target_dir(self.last_open_dir)
+        tasks = list(zip(paths, cover_names(target_dir, len(paths))))
+        worker = BatchCoverThread(tasks, options.combo_ratio.currentData(), options.combo_anchor.currentData())
+        dialog = self.export_progress_dialog("正在生成封面...", len(tasks), worker)
+
+        def done(count, cancelled, failures):
+            dialog.close()
+            msg = f"已生成 {count} 张封面，保存至:\n{target_dir}" + format_failures(failures)
+            title = "已取消" if cancelled else ("部分失败" if failures else "完成")
+            box = QMessageBox.warning if failures else QMessageBox.information
+            box(self, title, ("已取消，" if cancelled else "") + msg)
+        worker.done_signal.connect(done)
+        self.export_worker = worker
+        worker.start()
+
     def open_in_ps(self):
         selected_items = self.view.scene.selectedItems()
         img_paths = [i.path for i in selected_items if isinstance(i, ThumbnailItem)]
@@ -805,25 +2318,17 @@ class FocusImageMain(QMainWindow):
 
 # === 核心逻辑：使用COM控制PS保存并关闭 (修复JPEG弹窗问题) ===
     def save_and_close_ps_docs(self):
-        if not HAS_WIN32:
+        if self.ps_client_factory is None:
             QMessageBox.critical(self, "错误", "缺少必要的库 'pywin32'。\n请在终端运行: pip install pywin32")
             return
-            
         try:
-            # 获取 PS 实例
-            ps_app = win32com.client.GetActiveObject("Photoshop.Application")
+            client = self.ps_client_factory()
+            try: count = client.document_count()
+            finally: client.close()
         except Exception:
-            try:
-                ps_app = win32com.client.Dispatch("Photoshop.Application")
-            except Exception:
-                QMessageBox.warning(self, "提示", "未能连接到 Photoshop，请确认它是否正在运行。")
-                return
+            QMessageBox.warning(self, "提示", "未能连接到 Photoshop，请确认它是否正在运行。")
+            return
 
-        count = 0
-        try:
-            count = ps_app.Documents.Count
-        except: pass
-        
         if count == 0:
             QMessageBox.information(self, "提示", "Photoshop 中没有打开的文档。")
             return
@@ -833,47 +2338,26 @@ class FocusImageMain(QMainWindow):
         if reply == QMessageBox.StandardButton.No:
             return
 
-        # --- 关键设置：临时禁止 PS 弹窗 ---
-        # 3 = psDisplayNoDialogs (不显示弹窗)
-        original_dialog_mode = ps_app.DisplayDialogs
-        ps_app.DisplayDialogs = 3 
+        worker = PsBatchThread(self.ps_client_factory, count)
+        dialog = self.export_progress_dialog("正在保存并关闭 Photoshop 文档...", count, worker)
+        dialog.setWindowTitle("Photoshop")
+        worker.doc_signal.connect(lambda name, seconds, error: dialog.setLabelText(
+            f"{name} {'保存失败，已直接关闭' if error else '已保存并关闭'}（{seconds:.1f} 秒）"))
 
-        try:
-            # 准备 JPEG 保存选项 (预先填好回答，防止弹窗)
-            jpg_opts = win32com.client.Dispatch("Photoshop.JPEGSaveOptions")
-            jpg_opts.EmbedColorProfile = True
-            jpg_opts.FormatOptions = 1 # 1 = Standard
-            jpg_opts.Matte = 1 # 1 = No Matte
-            jpg_opts.Quality = 12 # 0-12, 12是最佳质量
-
-            # 倒序遍历关闭，防止索引偏移
-            while ps_app.Documents.Count > 0:
-                doc = ps_app.ActiveDocument
-                file_name = doc.Name.lower()
-                
-                try:
-                    # 如果是 JPG/JPEG，使用 SaveAs 覆盖原文件以应用选项
-                    if file_name.endswith('.jpg') or file_name.endswith('.jpeg'):
-                        # 参数: 路径, 选项, 是否作为副本(False), 扩展名大小写(2=lower)
-                        doc.SaveAs(doc.FullName, jpg_opts, False, 2)
-                        # 因为上面已经SaveAs存过了，这里选 "2" (DoNotSaveChanges) 直接关闭
-                        doc.Close(2) 
-                    else:
-                        # 对于 PSD、PNG 等其他格式，通常 Close(1) 就够了
-                        # 配合 DisplayDialogs = 3，大部分也不会弹窗
-                        doc.Close(1) # 1 = SaveChanges
-                except Exception as e_doc:
-                    print(f"关闭文档出错: {e_doc}")
-                    # 如果保存失败，强制不保存关闭，防止卡死循环
-                    doc.Close(2)
-
-            QMessageBox.information(self, "完成", "所有文档已保存并关闭。")
-            
-        except Exception as e:
-            QMessageBox.critical(self, "执行出错", f"操作过程中发生错误:\n{str(e)}")
-        finally:
-            # 恢复 PS 的弹窗设置，以免影响用户后续手动操作
-            ps_app.DisplayDialogs = original_dialog_mode
+        def done(finished, failed, cancelled, error):
+            dialog.close()
+            if error:
+                QMessageBox.critical(self, "执行出错", f"处理了 {finished} 个文档后中断:\n{error}")
+                return
+            total = sum(t[1] for t in worker.timings)
+            msg = f"已保存并关闭 {finished} 个文档，用时 {total:.1f} 秒。"
+            if failed: msg += f"\n其中 {failed} 个保存失败，已不保存直接关闭。"
+            slowest = sorted(worker.timings, key=lambda t: t[1], reverse=True)[:3]
+            if finished > 1: msg += "\n最慢: " + "、".join(f"{name} {seconds:.1f} 秒" for name, seconds, _ in slowest)
+            QMessageBox.information(self, "已取消" if cancelled else "完成", ("已取消，" if cancelled else "") + msg)
+        worker.done_signal.connect(done)
+        self.export_worker = worker
+        worker.start()
     # ========================================
     # ========================================
 
@@ -885,18 +2369,32 @@ class FocusImageMain(QMainWindow):
         if not save_dir: return
         try: start = int(self.spin_start.currentText())
         except: start = 10
-        count = 0
-        try:
-            for i, p in enumerate(paths):
-                try:
-                    with Image.open(p) as img:
-                        if img.mode != 'RGB': img = img.convert('RGB')
-                        name = f"{start + i*10:03d}.jpg"
-                        img.save(os.path.join(save_dir, name), quality=95)
-                    count += 1
-                except: pass
-            QMessageBox.information(self, "完成", f"已导出 {count} 张")
-        except Exception as e: QMessageBox.critical(self, "错误", str(e))
+        tasks = [(p, os.path.join(save_dir, f"{start + i*10:03d}.jpg")) for i, p in enumerate(paths)]
+        worker = ExportJpgThread(tasks, self.thumb_cache)
+        dialog = self.export_progress_dialog("正在导出 JPG...", len(tasks), worker)
+
+        def done(count, copied, cancelled, failures):
+            dialog.close()
+            msg = f"已导出 {count} 张（其中 {copied} 张原图直接拷贝）" + format_failures(failures)
+            title = "已取消" if cancelled else ("部分失败" if failures else "完成")
+            box = QMessageBox.warning if failures else QMessageBox.information
+            box(self, title, ("已取消，" if cancelled else "") + msg)
+        worker.done_signal.connect(done)
+        self.export_worker = worker
+        worker.start()
+
+    def export_progress_dialog(self, label, total, worker):
+        """后台导出的进度窗：按钮取消只是通知线程收尾，不阻塞界面"""
+        dialog = QProgressDialog(label, "取消", 0, total, self)
+        dialog.setWindowTitle("导出")
+        dialog.setWindowModality(Qt.WindowModality.WindowModal)
+        dialog.setMinimumDuration(0)
+        dialog.setAutoClose(False)
+        dialog.setAutoReset(False)
+        dialog.setValue(0)
+        dialog.canceled.connect(worker.stop)
+        worker.progress_signal.connect(lambda c, t: dialog.setValue(c))
+        return dialog
 
     def export_pdf(self):
         paths = [item.path for item in self.view.items_list]
@@ -904,33 +2402,22 @@ class FocusImageMain(QMainWindow):
         start_dir = self.get_initial_dir()
         save_path, _ = QFileDialog.getSaveFileName(self, "保存PDF", os.path.join(start_dir, "output.pdf"), "*.pdf")
         if not save_path: return
-        try:
-            valid_imgs = []
-            max_w = 0
-            for p in paths:
-                try:
-                    with Image.open(p) as img:
-                        max_w = max(max_w, img.width)
-                        valid_imgs.append(p)
-                except: pass
-            if not valid_imgs: return
-            margin = 20
-            page_w = max_w + margin*2
-            c = canvas.Canvas(save_path, pagesize=(page_w, 100))
-            for p in valid_imgs:
-                try:
-                    with Image.open(p) as img:
-                        w, h = img.size
-                        draw_w = page_w - margin*2
-                        scale = draw_w / w
-                        draw_h = h * scale
-                        c.setPageSize((page_w, draw_h + margin*2))
-                        c.drawImage(PDFImageReader(img), margin, margin, width=draw_w, height=draw_h)
-                        c.showPage()
-                except: pass
-            c.save()
-            QMessageBox.information(self, "完成", "PDF已生成")
-        except Exception as e: QMessageBox.critical(self, "错误", str(e))
+        profile = self.combo_pdf.currentData()
+        worker = ExportPdfThread(paths, save_path, profile, self.thumb_cache)
+        dialog = self.export_progress_dialog("正在生成 PDF...", len(paths), worker)
+
+        def done(pages, cancelled, error, seconds, failures):
+            dialog.close()
+            if error: QMessageBox.critical(self, "错误", error + format_failures(failures))
+            elif cancelled: QMessageBox.information(self, "已取消", "已取消，未生成 PDF")
+            else:
+                size_mb = os.path.getsize(save_path) / (1024 * 1024)
+                box = QMessageBox.warning if failures else QMessageBox.information
+                box(self, "部分失败" if failures else "完成", f"PDF已生成（{PDF_PROFILES[profile]['label']}）\n"
+                    f"{pages} 页，{size_mb:.1f} MB，用时 {seconds:.1f} 秒" + format_failures(failures))
+        worker.done_signal.connect(done)
+        self.export_worker = worker
+        worker.start()
 
     def load_last_config(self):
         if os.path.exists(self.config_file):
@@ -944,12 +2431,20 @@ class FocusImageMain(QMainWindow):
             except: pass
 
     def save_config(self, path):
+        # config.json 与动作选取工具共用，只更新本工具的字段
+        data = {}
+        try:
+            with open(self.config_file, 'r', encoding='utf-8') as f: data = json.load(f)
+        except: pass
+        data.update({"last_dir": path, "ps_path": self.ps_path})
         try:
             with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump({"last_dir": path, "ps_path": self.ps_path}, f)
+                json.dump(data, f, indent=4, ensure_ascii=False)
         except: pass
 
 if __name__ == "__main__":
+    # 打包成 exe 后进程池的子进程会重新执行入口，必须先交给 freeze_support 处理，否则每个子进程都会再开一个窗口
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     window = FocusImageMain()
     window.show()